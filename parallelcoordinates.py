@@ -2,7 +2,13 @@
 
 from PyQt4 import QtCore  
 from PyQt4 import QtGui
+import copy
 import math
+import time
+import numpy
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
 
 class PCFeature(object):
     """This structure is used to hold simple feature information"""
@@ -14,12 +20,163 @@ class PCFeature(object):
         if normalizedAttributeValues is None: normalizedAttributeValues = dict()     
         
 
+class PCFeatureBatch(object):
+    """This structure is used to hold simple feature information of several features at once"""
+    def __init__(self, ids, isSelected, isVisible, attributeValues, bounds = None):
+        self.ids = ids                                                              # List of feature ids
+        self.isSelected = isSelected                                                # List holding for each feature whether it is selected
+        self.isVisible = isVisible                                                  # List holding for each feature whether it is visible
+        self.attributeValues = attributeValues                                      # Dictionary holding for each attributeIndex a list of values, one per feature
+        self.bounds = bounds                                                        # List holding for each feature a (xMin, yMin, xMax, yMax) tuple or None if it has no geometry, only filled if asked for
+
+class PCBrush(object):
+    """This structure is used to hold a brushed range of an axis"""
+    def __init__(self, attributeId, minimum, maximum, operation, mask):
+        self.attributeId = attributeId
+        self.minimum = minimum                                                      # Brushed range of normalized values
+        self.maximum = maximum
+        self.operation = operation                                                  # Combination with the brushes before: "and", "or" or "not" (and not)
+        self.mask = mask                                                            # Boolean array which is True for each brushed row
+        self.combinedMask = None                                                    # Boolean array holding the combination of this brush and all brushes before
+
+class PCStripJob(object):
+    """This structure is used to hold the state of an image of lines between two axes which is rendered in chunks, see PCManager.renderStripChunks"""
+    def __init__(self, image, rows):
+        self.image = image                                                          # Image holding the lines drawn so far
+        self.rows = rows                                                            # Rows whose lines are drawn
+        self.nextRow = 0                                                            # Index into rows of the first line which has not been drawn yet
+
+class PCProfileSpan(object):
+    """This context manager measures the time spent in a stage, see PCProfiler.span"""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name                                                            # Name of the stage
+        self.startTime = None                                                       # Time at which the span was entered, None if the profiler was disabled
+        self.childTime = 0.0                                                        # Time spent in spans entered inside this span
+    
+    def __enter__(self):
+        if self.profiler.isEnabled:
+            self.profiler.enterSpan(self)
+        return self
+    
+    def __exit__(self, exceptionType, exception, traceback):
+        if self.startTime is not None:
+            self.profiler.exitSpan(self)
+        return False
+
+class PCProfiler(object):
+    """This class collects the time spent in the stages of loading and drawing and counters of what has been drawn. 
+    The spans and counters collected since the previous frame are passed to each callback whenever a frame is drawn, 
+    as a dictionary holding a dictionary of stages and seconds ("spans") and one of counter names and values ("counters").
+    The time spent in a span inside another span only counts for the inner one, so the times of a frame add up."""
+    stages = ("fetch", "normalize", "visibility", "selection", "scene", "rasterize", "composite")
+    
+    def __init__(self):
+        self.isEnabled = False                                                      # Nothing is measured unless this is True
+        self.callbacks = list()                                                     # Functions called with each frame
+        self.spans = dict()                                                         # Dictionary of stages and the seconds spent in them since the previous frame
+        self.counters = dict()                                                      # Dictionary of counters since the previous frame, e.g. "featuresDrawn", "segmentsDrawn" and "redrawsCoalesced"
+        self.lastFrame = None                                                       # The last frame passed to the callbacks
+        self.lock = threading.Lock()                                                # Data may be loaded in a PCDataLoader while drawing
+        self.threadSpans = threading.local()                                        # Stack of the entered spans of each thread
+    
+    def addCallback(self, callback):
+        self.callbacks.append(callback)
+    
+    def removeCallback(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+    
+    def span(self, name):
+        """Returns a context manager which adds the time spent inside it to the stage name"""
+        return PCProfileSpan(self, name)
+    
+    def enterSpan(self, span):
+        if not hasattr(self.threadSpans, "stack"):
+            self.threadSpans.stack = list()
+        span.startTime = time.time()
+        self.threadSpans.stack.append(span)
+    
+    def exitSpan(self, span):
+        duration = time.time() - span.startTime
+        stack = self.threadSpans.stack
+        stack.remove(span)
+        if len(stack) > 0:
+            stack[-1].childTime += duration
+        
+        with self.lock:
+            self.spans[span.name] = self.spans.get(span.name, 0.0) + duration - span.childTime
+    
+    def count(self, name, value = 1):
+        """Adds value to the counter name"""
+        if self.isEnabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+    
+    def setCounter(self, name, value):
+        if self.isEnabled:
+            with self.lock:
+                self.counters[name] = value
+    
+    def finishFrame(self):
+        """Passes the spans and counters collected since the previous frame to the callbacks and starts a new frame"""
+        if not self.isEnabled:
+            return
+        
+        with self.lock:
+            frame = {"spans": self.spans, "counters": self.counters}
+            self.spans = dict()
+            self.counters = dict()
+        
+        self.lastFrame = frame
+        for callback in list(self.callbacks):
+            callback(frame)
+    
+    def formatFrame(self, frame, separator = ", "):
+        """Returns a text showing the time of each stage in milliseconds and the counters of frame, e.g. for logging"""
+        names = [name for name in self.stages if name in frame["spans"]] + sorted(name for name in frame["spans"] if name not in self.stages)
+        texts = ["%s %.1f ms" % (name, 1000.0 * frame["spans"][name]) for name in names]
+        texts.extend("%s %s" % (name, frame["counters"][name]) for name in sorted(frame["counters"]))
+        return separator.join(texts)
+
+class PCSpatialIndex(object):
+    """This class holds the bounding boxes of all features to find the rows which intersect a rectangle without asking the data provider"""
+    def __init__(self, bounds):
+        bounds = numpy.array(bounds, dtype=float).reshape(-1, 4)                   # One row of xMin, yMin, xMax, yMax per feature, NaN if it has no geometry
+        self.rowCount = len(bounds)
+        
+        # The boxes are sorted by xMin, so only a slice of them has to be tested for each rectangle
+        rows = numpy.flatnonzero(~numpy.isnan(bounds).any(axis=1))
+        self.rows = rows[numpy.argsort(bounds[rows, 0], kind="mergesort")]
+        self.xMinimums = bounds[self.rows, 0]
+        self.yMinimums = bounds[self.rows, 1]
+        self.xMaximums = bounds[self.rows, 2]
+        self.yMaximums = bounds[self.rows, 3]
+        self.maximumWidth = (self.xMaximums - self.xMinimums).max() if len(self.rows) > 0 else 0.0 # Boxes starting further left than this cannot reach a rectangle
+        
+    def rowsInRectangle(self, xMin, yMin, xMax, yMax):
+        """Returns the rows whose bounding boxes intersect the rectangle"""
+        first = numpy.searchsorted(self.xMinimums, xMin - self.maximumWidth, "left")
+        last = numpy.searchsorted(self.xMinimums, xMax, "right")
+        
+        intersects = self.xMaximums[first:last] >= xMin
+        intersects &= self.yMinimums[first:last] <= yMax
+        intersects &= self.yMaximums[first:last] >= yMin
+        return self.rows[first:last][intersects]
+    
+    def maskForRectangle(self, xMin, yMin, xMax, yMax):
+        """Returns a boolean array which is True for each row whose bounding box intersects the rectangle"""
+        mask = numpy.zeros(self.rowCount, dtype=bool)
+        mask[self.rowsInRectangle(xMin, yMin, xMax, yMax)] = True
+        return mask
+
 class PCAttribute(object):
     """This absrtact structure is used to hold simple attribute information"""
     def __init__(self, id_, name, isVisible):
         self.id_ = id_
         self.name = name
         self.isVisible = isVisible
+        self.nullCount = None       # Number of features without a value, None unless it has been counted while reading the features
 
 class PCNumericalAttribute(PCAttribute):
     """This structure is used to hold simple numerical attribute information"""
@@ -40,18 +197,89 @@ class PCCategoricalAttribute(PCAttribute):
         if uniqueValues is None: uniqueValues = list()
         self.uniqueValues = uniqueValues
         self.numberUniqueValues = len(uniqueValues)
+
+class PCAttributeStatistics(object):
+    """This class accumulates the statistics of an attribute chunk by chunk while its values are read, see PCData.readAttributeColumns.
+    The values of categorical attributes whose unique values are not known are encoded in the order they are found and recoded by recode."""
+    def __init__(self, isKnown):
+        self.isKnown = isKnown                                                      # True if the data interface gave the statistics, then only NULL values are counted
+        self.minimum = None                                                         # Smallest value found so far, None if there was none
+        self.maximum = None
+        self.nullCount = 0
+        self.valueToCode = dict()                                                   # Dictionary of the distinct values found so far and their preliminary codes
+    
+    def update(self, attribute, rawColumn):
+        """Adds the raw values or category codes of a chunk"""
+        if attribute.scale == "numerical":
+            isNull = numpy.isnan(rawColumn)
+            if not self.isKnown and not isNull.all():
+                values = rawColumn[~isNull]
+                self.minimum = values.min() if self.minimum is None else min(self.minimum, values.min())
+                self.maximum = values.max() if self.maximum is None else max(self.maximum, values.max())
+        else:
+            isNull = rawColumn < 0
+        self.nullCount += int(numpy.count_nonzero(isNull))
+    
+    def values(self, attribute):
+        """Returns a dictionary of the NULL count and the statistics which were not known, with which the attribute is updated"""
+        values = {"nullCount": self.nullCount}
+        if self.isKnown:
+            return values
+        if attribute.scale == "numerical":
+            values["minimum"] = float(self.minimum) if self.minimum is not None else 0.0
+            values["maximum"] = float(self.maximum) if self.maximum is not None else 0.0
+        else:
+            values["uniqueValues"] = sorted(self.valueToCode)
+            values["numberUniqueValues"] = len(self.valueToCode)
+        return values
+    
+    def recode(self, attribute, rawColumn):
+        """Replaces the preliminary category codes in rawColumn, which may be a part of the column, by the positions in the sorted unique values"""
+        if self.isKnown or attribute.scale == "numerical" or len(self.valueToCode) == 0:
+            return
+        codeToPosition = numpy.zeros(len(self.valueToCode), dtype=numpy.int32)
+        codeToPosition[[self.valueToCode[value] for value in sorted(self.valueToCode)]] = numpy.arange(len(self.valueToCode))
+        isNotNull = rawColumn >= 0
+        rawColumn[isNotNull] = codeToPosition[rawColumn[isNotNull]]
              
 class PCDataInterface(object):
     """This abstract class should be subclassed to provide data access to an external data provider"""
     def nextAttribute(self, attribute):
+        """Fills attribute with the next attribute, returns False if there are no attributes left. The minimum and maximum of numerical attributes 
+        and the unique values of categorical ones may be None if they cannot be determined cheaply, they are computed while reading the features then."""
         pass
     
     def nextFeature(self, feature):
         pass
     
+    def featureCount(self):
+        """Returns the number of features or -1 if it is not known in advance"""
+        return -1
+    
+    def supportsFeatureBatches(self):
+        """Returns True if nextFeatureBatch is implemented, otherwise nextFeature is used"""
+        return False
+    
+    def supportsBounds(self):
+        """Returns True if nextFeatureBatch can fill the bounding boxes of the features, they are used to answer setVisibleRectangle without the data provider"""
+        return False
+    
+    def nextFeatureBatch(self, batch, attributeIds, batchSize, withBounds = False):
+        """Fills batch with the values of the attributes in attributeIds for up to batchSize features, returns False if no features are left.
+        If withBounds is True, the bounding boxes of the features are filled as well."""
+        pass
+    
     def finished(self):
         pass
     
+    def cacheKey(self):
+        """Returns a string which changes whenever the data changes, used to store the data in a PCColumnCache, or None if it must not be cached"""
+        return None
+    
+    def getSelectedFeatureIds(self):
+        """Returns the ids of the selected features, used instead of reading the features if they are cached"""
+        return list()
+    
     def setSelectedFeatureIds(self, idList):
         pass
     
@@ -61,22 +289,133 @@ class PCData(object):
         self.pcManager = pcManager
         self.dataInterface = dataInterface
         self.attributeDict = dict()             # holds dictionary of PCAttribute objects with the id as key
-        self.featureDict = dict()               # holds dictionary of PCFeature objects with the id as key
+        
+        # Feature data is stored column-wise: row i of every array belongs to the feature with id featureIds[i]
+        self.featureIds = numpy.zeros(0, dtype=numpy.int64)     # holds the feature ids in row order
+        self.idOrder = numpy.zeros(0, dtype=numpy.int64)        # Rows sorted by feature id, used by rowsForIds
+        self.sortedFeatureIds = numpy.zeros(0, dtype=numpy.int64)   # featureIds in the order of idOrder
+        self.rawColumns = dict()                # Dictionary of attribute ids and arrays of raw values (NaN for NULL) or category codes (-1 for NULL)
+        self.normalizedColumns = dict()         # Dictionary of attribute ids and arrays of normalized values
+        self.sortedIndices = dict()             # Dictionary of attribute ids and the rows sorted by normalized value together with the sorted values, see sortedIndex
+        self.brushes = list()                   # List of PCBrush objects in the order they are combined
+        self.selectedMask = numpy.zeros(0, dtype=bool)          # True for each row whose feature is selected
+        self.visibleMask = numpy.zeros(0, dtype=bool)           # True for each row whose feature is visible
+        self.selectedVersion = 0                # Incremented whenever selectedMask changes, used to identify cached renderings
+        self.visibleVersion = 0                 # Incremented whenever visibleMask changes
+        self.spatialIndex = None                # PCSpatialIndex of the bounding boxes of the features, None if the data interface does not provide them or they changed
         
         self.attributeToPosition = dict()       # Dictionary of attributes and their corresponding positions
         self.positionToAttribute = dict()       # Dictionary of positions and their corresponding attributes
         
-    def fetchAllData(self, setProgress):
+        self.batchSize = 10000                  # Number of features requested at once if the data interface supports batches
+        self.columnCache = None                 # PCColumnCache in which the data is kept between sessions, see fetchAllData
+        self.cacheKey = None                    # Key of the data in columnCache, None if it is not cached
+        self.isTemporaryCache = False           # True if the entry of cacheKey only holds memory-mapped columns of this data, it is removed by clear
+        self.memoryBudget_bytes = None          # If set, columns exceeding it are memory-mapped from columnCache and all columns are processed in chunks, see chunkSize
+        
+    def clear(self):
         self.attributeDict.clear()
-        self.featureDict.clear()
+        self.setFeatureIds(numpy.zeros(0, dtype=numpy.int64))
+        self.rawColumns.clear()
+        self.normalizedColumns.clear()
+        self.sortedIndices.clear()
+        self.brushes = list()
+        self.setSelectedMask(numpy.zeros(0, dtype=bool))
+        self.setVisibleMask(numpy.zeros(0, dtype=bool))
+        self.spatialIndex = None
         self.attributeToPosition.clear()
         self.positionToAttribute.clear()
         
+        # Nothing else reads a temporary entry, its columns are not referenced any more
+        if self.isTemporaryCache:
+            self.columnCache.removeEntry(self.cacheKey)
+            self.isTemporaryCache = False
+            self.cacheKey = None
+        
+    def featureCount(self):
+        return len(self.featureIds)
+    
+    def setFeatureIds(self, featureIds):
+        self.featureIds = featureIds
+        self.idOrder = numpy.argsort(featureIds, kind="mergesort")
+        self.sortedFeatureIds = featureIds[self.idOrder]
+    
+    def rowsForIds(self, ids):
+        """Returns an array holding the row of each of the ids or -1 if there is no feature with that id"""
+        ids = numpy.fromiter(ids, dtype=numpy.int64)
+        rows = numpy.empty(len(ids), dtype=numpy.int64)
+        rows.fill(-1)
+        if self.featureCount() == 0:
+            return rows
+        
+        # Two arrays sorted by id need much less memory than a dictionary, so they are used for large layers as well
+        positions = numpy.minimum(numpy.searchsorted(self.sortedFeatureIds, ids), self.featureCount() - 1)
+        isKnown = self.sortedFeatureIds[positions] == ids
+        rows[isKnown] = self.idOrder[positions[isKnown]]
+        return rows
+    
+    def chunkSize(self):
+        """Returns the number of rows which are processed at once, which depends on memoryBudget_bytes"""
+        if self.memoryBudget_bytes is None:
+            return max(1, self.featureCount())
+        return max(10000, self.memoryBudget_bytes // 1024) # The lines drawn for a row need a few hundred bytes
+    
+    def mapsColumns(self, attributeCount):
+        """Returns True if attributeCount more columns are memory-mapped, because they would exceed memoryBudget_bytes"""
+        if self.memoryBudget_bytes is None or self.cacheKey is None:
+            return False
+        return 16 * self.featureCount() * (len(self.rawColumns) + attributeCount) > self.memoryBudget_bytes
+    
+    def setSelectedMask(self, mask):
+        """Replaces the selected mask and returns the rows whose selection state changed, nothing is changed if there are none"""
+        changedRows = self.maskDelta(self.selectedMask, mask)
+        if changedRows is None or len(changedRows) > 0:
+            self.selectedMask = mask
+            self.selectedVersion += 1
+        return changedRows
+    
+    def setVisibleMask(self, mask):
+        """Replaces the visible mask and returns the rows whose visibility changed, nothing is changed if there are none"""
+        changedRows = self.maskDelta(self.visibleMask, mask)
+        if changedRows is None or len(changedRows) > 0:
+            self.visibleMask = mask
+            self.visibleVersion += 1
+        return changedRows
+    
+    def maskDelta(self, oldMask, newMask):
+        """Returns the rows in which both masks differ or None if they cannot be compared"""
+        if len(oldMask) != len(newMask) or len(newMask) == 0:
+            return None
+        return numpy.flatnonzero(oldMask != newMask)
+    
+    def maskForIds(self, idList):
+        """Returns a boolean array which is True for each row whose feature id is in idList"""
+        rows = self.rowsForIds(idList)
+        mask = numpy.zeros(self.featureCount(), dtype=bool)
+        mask[rows[rows != -1]] = True
+        return mask
+        
+    def fetchAllData(self, setProgress, isCanceled = None):
+        """Reads attributes and features from the data interface, returns False if it was canceled by isCanceled"""
+        self.clear()
+        
         if self.dataInterface is None:
             #print "Data interface not set. Aborting."
-            return
+            return False
 
         setProgress(0)
+        
+        # Data which has been read before is taken from the cache, the columns are loaded on demand by loadAttributes
+        self.cacheKey = self.dataInterface.cacheKey() if self.columnCache is not None else None
+        if self.cacheKey is not None and self.loadCachedFeatures():
+            setProgress(100)
+            self.dataInterface.finished()
+            return True
+        
+        # Data which cannot be cached is still written to the cache if it may have to be memory-mapped, it is removed by clear
+        if self.cacheKey is None and self.columnCache is not None and self.memoryBudget_bytes is not None:
+            self.cacheKey = "temporary|%s|%r" % (id(self), time.time())
+            self.isTemporaryCache = True
 
         # get attribute information
         attribute = PCAttribute(None, None, None)
@@ -86,59 +425,443 @@ class PCData(object):
             attribute = PCAttribute(None, None, None) # We need a new attribute for each attribute or else they are all bound to the same object
         #print "Fetched " + str(len(self.attributeDict)) + " attributes."
 
-        setProgress(33)
-
-        #TODO: calculate min and max if not given
-        #TODO: determine unique values if not given
-
-        # get feature information
-        feature = PCFeature(None, None, None, None, None)
-        while self.dataInterface.nextFeature(feature):
-            self.featureDict[feature.id] = feature
-            feature = PCFeature(None, None, None, None, None)  # Same here as in the attributes loop
-
-        setProgress(66)
-
-        # normalize feature values
-        for attributeId, attribute in self.attributeDict.items():
-            #print "Normalizing Attribute: " + str(attribute.name)
-            #print "Scale of Attribute: " + attribute.scale
-            if attribute.scale == "numerical":
-                maxValue = attribute.maximum
-                minValue = attribute.minimum
-                #print self.featureDict.items()
-                for id_, feat in self.featureDict.items():
-                    #print (feat.attributeValues[attributeId] is None) == False
-                    #print str(maxValue != minValue and ((feat.attributeValues[attributeId] is None) == False))
-                    normalizedValue = 0.5
-                    if maxValue != minValue and ((feat.attributeValues[attributeId] is None) == False): # Prevents division by zero and use of NULL values
-                        rawValue = float(feat.attributeValues[attributeId])
-                        normalizedValue = (rawValue - minValue) / (maxValue - minValue)
-                        #print normalizedValue
-
-                    feat.normalizedAttributeValues[attributeId] = normalizedValue
-            elif attribute.scale == "categorical":
-                for id_, feat in self.featureDict.items():
-                    normalizedValue = 0.5
-                    if (feat.attributeValues[attributeId] is None) == False: # TODO: Switched from feat.attributeValues[attributeId].isNull() == False to the present version... revise
-                        #print (feat.attributeValues[attributeId] is None) == False
-                        #print feat.attributeValues[attributeId]
-                        #print attribute.uniqueValues
-                        rawValue = str(feat.attributeValues[attributeId])
-                        position = attribute.uniqueValues.index(rawValue)
-                        normalizedValue = position / float(attribute.numberUniqueValues -1)
-                        
-                    feat.normalizedAttributeValues[attributeId] = normalizedValue
+        setProgress(5)
+
+        # get feature information; if the data interface supports batches only the ids (and bounding boxes) are read here 
+        # and the attribute columns are loaded on demand by loadAttributes
+        if self.dataInterface.supportsFeatureBatches():
+            attributeIds = list()
+        else:
+            attributeIds = list(self.attributeDict)
+        statistics = dict((attributeId, PCAttributeStatistics(self.hasStatistics(self.attributeDict[attributeId]))) for attributeId in attributeIds)
+        
+        # The features are turned into arrays chunk by chunk, so there are never many of them in lists
+        chunks = list()
+        def consumeChunk(featureIds, isSelected, isVisible, columnValues, bounds):
+            if bounds is not None:
+                bounds = numpy.array([(numpy.nan,) * 4 if box is None else box for box in bounds], dtype=float).reshape(-1, 4)
+            chunks.append((numpy.array(featureIds, dtype=numpy.int64), numpy.array(isSelected, dtype=bool), numpy.array(isVisible, dtype=bool), 
+                           self.createColumns(columnValues, statistics), bounds))
+        
+        with self.pcManager.profiler.span("fetch"):
+            isComplete = self.readFeatures(attributeIds, consumeChunk, lambda progress: setProgress(5 + int(0.85 * progress)), isCanceled, withBounds = True)
+        if not isComplete:
+            self.clear()
+            self.dataInterface.finished()
+            return False
+        
+        if len(chunks) == 0:
+            chunks.append((numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=bool), numpy.zeros(0, dtype=bool), 
+                           self.createColumns(dict((attributeId, list()) for attributeId in attributeIds)), None))
+        
+        self.setFeatureIds(numpy.concatenate([chunk[0] for chunk in chunks]))
+        self.setSelectedMask(numpy.concatenate([chunk[1] for chunk in chunks]))
+        self.setVisibleMask(numpy.concatenate([chunk[2] for chunk in chunks]))
+        bounds = None
+        if chunks[0][4] is not None:
+            bounds = numpy.concatenate([chunk[4] for chunk in chunks])
+            self.spatialIndex = PCSpatialIndex(bounds)
+        
+        setProgress(90)
+        
+        # The columns of attributes whose statistics were not known are normalized once the statistics are complete
+        columns = dict()
+        for attributeId in attributeIds:
+            attribute = self.attributeDict[attributeId]
+            rawColumn = numpy.concatenate([chunk[3][attributeId][0] for chunk in chunks])
+            statistics[attributeId].recode(attribute, rawColumn)
+            attribute.__dict__.update(statistics[attributeId].values(attribute))
+            if statistics[attributeId].isKnown:
+                normalizedColumn = numpy.concatenate([chunk[3][attributeId][1] for chunk in chunks])
+            else:
+                with self.pcManager.profiler.span("normalize"):
+                    normalizedColumn = self.normalizeColumn(attribute, rawColumn)
+            columns[attributeId] = (rawColumn, normalizedColumn)
+        del chunks[:] # Frees the chunks, the list itself is referenced by consumeChunk
+        
+        if self.cacheKey is not None:
+            self.columnCache.storeFeatures(self.cacheKey, self.attributeDict, self.featureIds, bounds)
+            self.storeCachedColumns(columns)
+            
+            # Columns which do not fit into the memory budget are replaced by their memory-mapped files
+            if self.mapsColumns(len(columns)):
+                for attributeId in list(columns):
+                    column = self.columnCache.loadColumn(self.cacheKey, attributeId, True)
+                    if column is not None:
+                        columns[attributeId] = column
+        
+        self.storeColumns(columns)
 
         setProgress(100)
 
         # tell the provider that we have finished our actions to give it the opportunity to clean up
         self.dataInterface.finished()
+        return True
+    
+    def loadCachedFeatures(self):
+        """Takes the attributes, feature ids and bounding boxes from the cache, returns False if they are not cached"""
+        with self.pcManager.profiler.span("fetch"):
+            features = self.columnCache.loadFeatures(self.cacheKey)
+        if features is None:
+            return False
+        
+        self.attributeDict, featureIds, bounds = features
+        self.setFeatureIds(featureIds)
+        self.setSelectedMask(self.maskForIds(self.dataInterface.getSelectedFeatureIds()))
+        self.setVisibleMask(numpy.ones(self.featureCount(), dtype=bool))
+        if bounds is not None:
+            self.spatialIndex = PCSpatialIndex(bounds)
+        return True
+    
+    def storeCachedColumns(self, columns):
+        for attributeId, (rawColumn, normalizedColumn) in columns.items():
+            self.columnCache.storeColumn(self.cacheKey, attributeId, rawColumn, normalizedColumn)
+    
+    def setBrush(self, attributeId, minimum, maximum, operation):
+        """Brushes the rows whose normalized values of the attribute are between minimum and maximum and returns the combined mask of all brushes.
+        A brush which already exists for the attribute is replaced, only its mask and the combination with the brushes after it are recomputed."""
+        mask = self.maskInRange(attributeId, minimum, maximum)
+        brush = PCBrush(attributeId, minimum, maximum, operation, mask)
+        
+        index = len(self.brushes)
+        for existingIndex, existingBrush in enumerate(self.brushes):
+            if existingBrush.attributeId == attributeId:
+                index = existingIndex
+        
+        if index == len(self.brushes):
+            self.brushes.append(brush)
+        else:
+            self.brushes[index] = brush
+        
+        self.combineBrushes(index)
+        return self.brushes[-1].combinedMask
+    
+    def combineBrushes(self, firstIndex):
+        """Updates the combined masks of all brushes starting with the brush at firstIndex"""
+        for index in range(firstIndex, len(self.brushes)):
+            brush = self.brushes[index]
+            if index > 0:
+                previousMask = self.brushes[index-1].combinedMask
+            elif brush.operation == "or":
+                previousMask = numpy.zeros(self.featureCount(), dtype=bool)
+            else:
+                previousMask = numpy.ones(self.featureCount(), dtype=bool)
+            
+            if brush.operation == "or":
+                brush.combinedMask = previousMask | brush.mask
+            elif brush.operation == "not":
+                brush.combinedMask = previousMask & ~brush.mask
+            else:
+                brush.combinedMask = previousMask & brush.mask
+    
+    def clearBrushes(self):
+        self.brushes = list()
+    
+    def missingAttributes(self, attributeIds):
+        """Returns the ids of those attributes in attributeIds whose columns have not been loaded yet"""
+        return [attributeId for attributeId in attributeIds if attributeId in self.attributeDict and attributeId not in self.rawColumns]
+    
+    def loadAttributes(self, attributeIds, setProgress = None, isCanceled = None):
+        """Reads and normalizes the columns of those attributes in attributeIds which have not been loaded yet"""
+        columns = self.readAttributeColumns(attributeIds, setProgress, isCanceled)
+        if columns is None:
+            return False
+        
+        self.storeColumns(columns)
+        return True
+    
+    def readAttributeColumns(self, attributeIds, setProgress = None, isCanceled = None, dataInterface = None):
+        """Returns the raw and normalized columns of those attributes in attributeIds which have not been loaded yet
+        or None if it was canceled. As nothing but the cache is changed, this may run in a different thread. 
+        The features are read from dataInterface if it is given, e.g. a copy of the data interface whose state is not shared with the GUI thread.
+        The NULL count and the statistics which the data interface did not give are computed while reading the columns and returned 
+        as third entry of each column, storeColumns sets them on the attributes."""
+        if dataInterface is None:
+            dataInterface = self.dataInterface
+        
+        attributeIds = self.missingAttributes(attributeIds)
+        if len(attributeIds) == 0 or dataInterface is None:
+            return dict()
+        
+        # Cached columns do not have to be read, unless the statistics they were read with are missing
+        mapsColumns = self.mapsColumns(len(attributeIds))
+        cachedColumns = dict()
+        if self.cacheKey is not None:
+            for attributeId in attributeIds:
+                with self.pcManager.profiler.span("fetch"):
+                    column = self.columnCache.loadColumn(self.cacheKey, attributeId, mapsColumns)
+                    statisticsValues = self.columnCache.loadStatistics(self.cacheKey, attributeId)
+                if column is not None and len(column[0]) == self.featureCount() and (statisticsValues is not None or self.hasStatistics(self.attributeDict[attributeId])):
+                    cachedColumns[attributeId] = column + (statisticsValues,)
+            attributeIds = [attributeId for attributeId in attributeIds if attributeId not in cachedColumns]
+            if len(attributeIds) == 0:
+                return cachedColumns
+        
+        if setProgress is None:
+            setProgress = lambda progress: None
+        
+        setProgress(0)
+        
+        # The values are written to their rows chunk by chunk, either into arrays or into memory-mapped files
+        columns = dict()
+        statistics = dict()
+        for attributeId in attributeIds:
+            rawDtype = float if self.attributeDict[attributeId].scale == "numerical" else numpy.int32
+            column = None
+            if mapsColumns:
+                column = self.columnCache.createColumn(self.cacheKey, attributeId, self.featureCount(), rawDtype)
+            if column is None:
+                column = (numpy.empty(self.featureCount(), dtype=rawDtype), numpy.empty(self.featureCount(), dtype=float))
+            rawColumn, normalizedColumn = column
+            rawColumn.fill(numpy.nan if rawDtype is float else -1) # Features which are not read are NULL
+            normalizedColumn.fill(0.5)
+            columns[attributeId] = (rawColumn, normalizedColumn)
+            statistics[attributeId] = PCAttributeStatistics(self.hasStatistics(self.attributeDict[attributeId]))
+        
+        def consumeChunk(featureIds, isSelected, isVisible, columnValues, bounds):
+            # The features may have changed since the ids were read, so the values are assigned by id
+            rows = self.rowsForIds(featureIds)
+            isKnown = rows != -1
+            for attributeId, (rawChunk, normalizedChunk) in self.createColumns(columnValues, statistics).items():
+                rawColumn, normalizedColumn = columns[attributeId]
+                rawColumn[rows[isKnown]] = rawChunk[isKnown]
+                if normalizedChunk is not None:
+                    normalizedColumn[rows[isKnown]] = normalizedChunk[isKnown]
+        
+        with self.pcManager.profiler.span("fetch"):
+            isComplete = self.readFeatures(attributeIds, consumeChunk, lambda progress: setProgress(int(0.9 * progress)), isCanceled, dataInterface = dataInterface)
+        dataInterface.finished()
+        if not isComplete:
+            return None
+        
+        setProgress(90)
+        chunkSize = self.chunkSize()
+        for attributeId, (rawColumn, normalizedColumn) in list(columns.items()):
+            attribute = self.attributeDict[attributeId]
+            statisticsValues = statistics[attributeId].values(attribute)
+            
+            # Columns whose statistics were not known are recoded and normalized now, in chunks as they may be memory-mapped.
+            # The attribute is updated on a copy, the attribute itself is left to storeColumns.
+            if not statistics[attributeId].isKnown:
+                completeAttribute = copy.copy(attribute)
+                completeAttribute.__dict__.update(statisticsValues)
+                with self.pcManager.profiler.span("normalize"):
+                    for start in range(0, len(rawColumn), chunkSize):
+                        rawChunk = rawColumn[start:start + chunkSize]
+                        statistics[attributeId].recode(attribute, rawChunk)
+                        normalizedColumn[start:start + chunkSize] = self.normalizeColumn(completeAttribute, rawChunk)
+            
+            if isinstance(rawColumn, numpy.memmap):
+                column = self.columnCache.finishColumn(self.cacheKey, attributeId, rawColumn, normalizedColumn)
+                if column is None: # The files could not be written, so the columns are kept in memory
+                    column = (numpy.array(rawColumn), numpy.array(normalizedColumn))
+                rawColumn, normalizedColumn = column
+            elif self.cacheKey is not None:
+                self.columnCache.storeColumn(self.cacheKey, attributeId, rawColumn, normalizedColumn)
+            if self.cacheKey is not None:
+                self.columnCache.storeStatistics(self.cacheKey, attributeId, statisticsValues)
+            columns[attributeId] = (rawColumn, normalizedColumn, statisticsValues)
+        columns.update(cachedColumns)
+        setProgress(100)
+        
+        return columns
+    
+    def readFeatures(self, attributeIds, consumeChunk, setProgress = None, isCanceled = None, withBounds = False, dataInterface = None):
+        """Reads all features from the data interface and passes chunks of about chunkSize of them to consumeChunk, which is called with 
+        their ids, selection states, visibility states, the values of the attributes in attributeIds and their bounding boxes. 
+        The bounding boxes are None unless withBounds is True and the data interface supports them. Returns False if it was canceled.
+        The features are read from dataInterface if it is given, otherwise from the data interface of this data."""
+        if dataInterface is None:
+            dataInterface = self.dataInterface
+        chunkSize = max(self.chunkSize(), self.batchSize)
+        withBounds = withBounds and dataInterface.supportsFeatureBatches() and dataInterface.supportsBounds()
+        
+        def newChunk():
+            return list(), list(), list(), dict((attributeId, list()) for attributeId in attributeIds), list() if withBounds else None
+        featureIds, isSelected, isVisible, columnValues, bounds = newChunk()
+        
+        featureCount = dataInterface.featureCount()
+        readCount = 0
+        lastProgress = -1
+        
+        if dataInterface.supportsFeatureBatches():
+            batch = PCFeatureBatch(None, None, None, None)
+            if withBounds:
+                nextFeatureBatch = lambda: dataInterface.nextFeatureBatch(batch, list(attributeIds), self.batchSize, True)
+            else:
+                nextFeatureBatch = lambda: dataInterface.nextFeatureBatch(batch, list(attributeIds), self.batchSize)
+            
+            while nextFeatureBatch():
+                featureIds.extend(batch.ids)
+                isSelected.extend(batch.isSelected)
+                isVisible.extend(batch.isVisible)
+                for attributeId, values in columnValues.items():
+                    values.extend(batch.attributeValues[attributeId])
+                if withBounds:
+                    bounds.extend(batch.bounds)
+                readCount += len(batch.ids)
+                
+                if isCanceled is not None and isCanceled():
+                    return False
+                if len(featureIds) >= chunkSize:
+                    consumeChunk(featureIds, isSelected, isVisible, columnValues, bounds)
+                    featureIds, isSelected, isVisible, columnValues, bounds = newChunk()
+                if setProgress is not None and featureCount > 0 and 100 * readCount // featureCount != lastProgress:
+                    lastProgress = min(100, 100 * readCount // featureCount)
+                    setProgress(lastProgress)
+        else:
+            feature = PCFeature(None, None, None, None, None) # The feature is not kept, so it can be reused
+            while dataInterface.nextFeature(feature):
+                featureIds.append(feature.id)
+                isSelected.append(feature.isSelected)
+                isVisible.append(feature.isVisible)
+                for attributeId, values in columnValues.items():
+                    values.append(feature.attributeValues[attributeId])
+                readCount += 1
+                
+                if readCount % 1000 == 0:
+                    if isCanceled is not None and isCanceled():
+                        return False
+                    if len(featureIds) >= chunkSize:
+                        consumeChunk(featureIds, isSelected, isVisible, columnValues, bounds)
+                        featureIds, isSelected, isVisible, columnValues, bounds = newChunk()
+                    if setProgress is not None and featureCount > 0 and 100 * readCount // featureCount != lastProgress:
+                        lastProgress = min(100, 100 * readCount // featureCount)
+                        setProgress(lastProgress)
+        
+        if len(featureIds) > 0:
+            consumeChunk(featureIds, isSelected, isVisible, columnValues, bounds)
+        return True
+    
+    def createColumns(self, columnValues, statistics = None):
+        """Turns the lists of values in columnValues into a dictionary holding a raw and a normalized column for each attribute id.
+        If statistics is given, the PCAttributeStatistics of each attribute in it are updated. Attributes whose statistics are not known 
+        cannot be normalized yet, their normalized column is None."""
+        columns = dict()
+        with self.pcManager.profiler.span("normalize"):
+            for attributeId, values in columnValues.items():
+                attribute = self.attributeDict[attributeId]
+                attributeStatistics = statistics.get(attributeId) if statistics is not None else None
+                if attribute.scale == "numerical":
+                    rawColumn = numpy.array(values, dtype=float) # None becomes NaN
+                else:
+                    rawColumn = self.encodeCategories(attribute, values, attributeStatistics)
+                
+                if attributeStatistics is not None:
+                    attributeStatistics.update(attribute, rawColumn)
+                
+                #print "Normalizing Attribute: " + str(attribute.name)
+                isNormalized = attributeStatistics.isKnown if attributeStatistics is not None else self.hasStatistics(attribute)
+                normalizedColumn = self.normalizeColumn(attribute, rawColumn) if isNormalized else None
+                columns[attributeId] = (rawColumn, normalizedColumn)
+        
+        return columns
+    
+    def hasStatistics(self, attribute):
+        """Returns True if the minimum and maximum of a numerical attribute or the unique values of a categorical one are known"""
+        if attribute.scale == "numerical":
+            return getattr(attribute, "minimum", None) is not None and getattr(attribute, "maximum", None) is not None
+        return getattr(attribute, "uniqueValues", None) is not None
+    
+    def storeColumns(self, columns):
+        """Keeps the raw and normalized column of each attribute id in columns. An optional third entry holds the values of PCAttributeStatistics.values 
+        found while reading the column, which are set on the attribute here, as readAttributeColumns may run in a different thread."""
+        for attributeId, column in columns.items():
+            self.rawColumns[attributeId] = column[0]
+            self.normalizedColumns[attributeId] = column[1]
+            if len(column) > 2 and column[2] is not None:
+                self.attributeDict[attributeId].__dict__.update(column[2])
+            if attributeId in self.sortedIndices:
+                del self.sortedIndices[attributeId]
+    
+    def sortedIndex(self, attributeId):
+        """Returns the rows sorted by the normalized values of the attribute and the sorted values, the index is built on first use"""
+        if attributeId not in self.sortedIndices:
+            normalizedColumn = self.normalizedColumns[attributeId]
+            order = numpy.argsort(normalizedColumn, kind="mergesort")
+            self.sortedIndices[attributeId] = (order, normalizedColumn[order])
+        
+        return self.sortedIndices[attributeId]
+    
+    def maskInRange(self, attributeId, minimum, maximum):
+        """Returns a boolean array which is True for each row whose normalized value of the attribute is between minimum and maximum (inclusive).
+        Memory-mapped columns are scanned chunk by chunk, as their sorted index would have to be held in memory."""
+        mask = numpy.zeros(self.featureCount(), dtype=bool)
+        normalizedColumn = self.normalizedColumns[attributeId]
+        if isinstance(normalizedColumn, numpy.memmap):
+            chunkSize = self.chunkSize()
+            for first in range(0, self.featureCount(), chunkSize):
+                values = normalizedColumn[first:first+chunkSize]
+                mask[first:first+chunkSize] = (values >= minimum) & (values <= maximum)
+        else:
+            mask[self.rowsInRange(attributeId, minimum, maximum)] = True
+        return mask
+    
+    def rowsInRange(self, attributeId, minimum, maximum):
+        """Returns the rows whose normalized values of the attribute are between minimum and maximum (inclusive) using two binary searches"""
+        order, sortedValues = self.sortedIndex(attributeId)
+        first = numpy.searchsorted(sortedValues, minimum, side="left")
+        last = numpy.searchsorted(sortedValues, maximum, side="right")
+        return order[first:last]
+    
+    def encodeCategories(self, attribute, values, statistics = None):
+        """Returns an array holding for each value its position in attribute.uniqueValues or -1 for NULL. 
+        If statistics is given and the unique values were not known, its preliminary codes are used and extended by new values."""
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        codes.fill(-1)
+        
+        isNotNull = numpy.array([value is not None for value in values], dtype=bool)
+        if not isNotNull.any():
+            return codes
+        
+        # Each distinct value is looked up only once, the lookup result is then spread to all rows
+        strings = numpy.array([str(value) for value, notNull in zip(values, isNotNull) if notNull])
+        distinctValues, inverse = numpy.unique(strings, return_inverse=True)
+        
+        if statistics is not None and not statistics.isKnown:
+            valueToPosition = statistics.valueToCode
+            for value in distinctValues.tolist():
+                if value not in valueToPosition:
+                    valueToPosition[value] = len(valueToPosition)
+        else:
+            valueToPosition = dict((value, position) for position, value in enumerate(attribute.uniqueValues))
+        distinctPositions = numpy.array([valueToPosition.get(value, -1) for value in distinctValues.tolist()], dtype=numpy.int32)
+        codes[isNotNull] = distinctPositions[inverse]
+        return codes
+    
+    def normalizeColumn(self, attribute, rawColumn):
+        """Returns the values of rawColumn mapped to [0, 1]; NULL values and constant columns are mapped to 0.5"""
+        normalizedColumn = numpy.empty(len(rawColumn), dtype=float)
+        normalizedColumn.fill(0.5)
+        
+        if attribute.scale == "numerical":
+            maxValue = attribute.maximum
+            minValue = attribute.minimum
+            if maxValue != minValue: # Prevents division by zero
+                isNotNull = ~numpy.isnan(rawColumn)
+                normalizedColumn[isNotNull] = (rawColumn[isNotNull] - minValue) / (maxValue - minValue)
+        elif attribute.scale == "categorical":
+            if attribute.numberUniqueValues > 1: # Prevents division by zero
+                isNotNull = rawColumn >= 0
+                normalizedColumn[isNotNull] = rawColumn[isNotNull] / float(attribute.numberUniqueValues - 1)
+            
+        return normalizedColumn
       
     def moveAxes(self, firstPosition, secondPosition):
         if firstPosition == secondPosition: # nothing to change
             return
         
+        self.reorderAxes(firstPosition, secondPosition)
+    
+        # something changed, the axes and all lines are at new positions
+        self.pcManager.scheduleUpdate("layout")
+    pass
+
+    def reorderAxes(self, firstPosition, secondPosition):
+        """Moves the axis at firstPosition to secondPosition without drawing, see moveAxes"""
+        if firstPosition == secondPosition: # nothing to change
+            return
+        
         if (secondPosition % 1) > 0.0: # e.g. is a position between two axes
             # in this case one axis will be moved inbetween to other axes
             # therefore only the axispositions between these two positions need to be readjusted, and, of course, of the axis which changes the position
@@ -178,9 +901,9 @@ class PCData(object):
         for position, attribute in self.positionToAttribute.items():
             self.attributeToPosition[attribute] = position
     
-        # something changed
-        self.pcManager.drawParallelCoordinates()
-    pass
+    def setPositions(self, positionToAttribute):
+        self.positionToAttribute = dict(positionToAttribute)
+        self.attributeToPosition = dict((attribute, position) for position, attribute in positionToAttribute.items())
 
     def evaluateAttributeVisibility(self):
         #TODO ON MONDAY FUNCTION NOT WORKING PROPERLY
@@ -223,9 +946,34 @@ class PCData(object):
         #print "eAV self.attributeToPosition"
         #print self.attributeToPosition
         
-        self.pcManager.drawParallelCoordinates()
+        self.pcManager.scheduleUpdate("layout")
         pass
 
+class PCDataLoader(QtCore.QThread):
+    """This thread runs a loading job in the background. The job is a function that is called with a setProgress and an isCanceled function, 
+    its return value is available as result as soon as the thread has finished. If the job raised an exception, result is None and error holds its traceback."""
+    progressChanged = QtCore.pyqtSignal(int)
+    
+    def __init__(self, job):
+        QtCore.QThread.__init__(self)
+        
+        self.job = job
+        self.result = None
+        self.error = None
+        self.canceled = False
+        
+    def run(self):
+        try:
+            self.result = self.job(self.progressChanged.emit, self.isCanceled)
+        except Exception: # An exception cannot leave the thread, so it is passed on to whoever handles the result
+            self.error = traceback.format_exc()
+        
+    def cancel(self):
+        self.canceled = True
+        
+    def isCanceled(self):
+        return self.canceled
+
 class PCManager(object):    
     """This class constructs the Parallel Coordinates technique inside a QGraphicsScene using an instance of PCDataInterface"""
     def __init__(self, parent):
@@ -237,13 +985,63 @@ class PCManager(object):
         self.axes = list()                                                      # Axes to be drawn
         self.pixmapItem = QtGui.QPixmap()                                       # Pixmap to be created when everything is drawn to speed up things a little bit @UndefinedVariable
         
-        self.initialized = False
+        # Render cache
+        self.layerImages = dict()                                               # Dictionary of render layers and their images, layers which are not in here are rendered on the next draw
+        self.layerRect = QtCore.QRectF()                                        # Scene rectangle covered by the images of the render layers
+        self.stripImages = dict()                                               # Dictionary of images of the lines between two adjacent axes, see drawLineLayer
+        self.renderBackend = "painter"                                          # "painter" draws all lines at once, "scene" adds one QGraphicsLineItem per line (for debugging)
+        
+        # Density rendering, see setRenderMode
+        self.renderMode = "lines"                                               # "lines" draws one line per feature, "density" draws the binned line density
+        self.densityBins = 128                                                  # Number of bins per axis
+        self.densityTransferFunction = "log"                                    # "linear", "sqrt", "log" or a function mapping an array of counts and the maximum count to opacities in [0, 1]
+        self.histograms = dict()                                                # Dictionary of 2D histograms of the lines between two axes, cached like the strip images
+        
+        # Level of detail while interacting, see beginInteraction
+        self.isInteracting = False
+        self.previewSampleSize = 20000                                          # Number of visible features drawn between two axes in previews, adapted to previewFrameBudget_ms
+        self.previewFrameBudget_ms = 40                                         # Time which should not be exceeded by drawing the lines of a preview
+        self.previewStripImages = dict()                                        # Strip images drawn from samples, used instead of missing strip images in previews
+        self.previewLayers = set()                                              # Render layers which contain preview strip images
+        self.savedPositions = None                                              # Positions of the axes before previewAxisMove was called
+        self.refineTimer = QtCore.QTimer()                                      # Replaces previews by full renderings when nothing happened for a while
+        self.refineTimer.setSingleShot(True)
+        self.refineTimer.setInterval(300)
+        self.refineTimer.timeout.connect(self.refine)
+        
+        # Progressive rendering, see renderStripChunks
+        self.progressiveRendering = True                                        # Full renderings of lines are spread over several event loop iterations, showing the lines drawn so far
+        self.progressiveFrameBudget_ms = 30                                     # Time which should not be exceeded by one iteration
+        self.progressiveChunkSize = 2000                                        # Number of lines drawn at once
+        self.stripJobs = dict()                                                 # Dictionary of strip images which are still rendered, with the same keys as stripImages
+        self.progressiveLayers = set()                                          # Render layers which contain strip images that are not finished yet
+        self.progressiveTimer = QtCore.QTimer()
+        self.progressiveTimer.setSingleShot(True)
+        self.progressiveTimer.timeout.connect(self.renderStripChunks)
+        
+        # Multi-threaded rendering, see setRenderThreads
+        self.renderThreads = 1                                                  # Number of threads which draw shards of the lines of a strip into images of their own
+        self.minimumShardSize = 10000                                           # Strips with less lines than this per thread use less threads
+        self.renderPool = None                                                  # ThreadPool of renderThreads threads, None if the lines are drawn serially
+        
+        # Update scheduling, see scheduleUpdate
+        self.dirtyFlags = set()                                                 # Changes which have not been drawn yet: "data", "layout", "selection", "brushes" and "visibility"
+        self.maximumUpdateRate_hz = 30                                          # Maximum number of scheduled redraws per second
+        self.lastUpdateTime = 0.0                                               # Time at which the last scheduled redraw finished
+        self.coalescedRedraws = 0                                               # Number of redraws which were saved because the change was drawn together with a pending one
+        self.updateTimer = QtCore.QTimer()
+        self.updateTimer.setSingleShot(True)
+        self.updateTimer.timeout.connect(self.flushUpdates)
+        
+        # Profiling, see setProfileOverlay
+        self.profiler = PCProfiler()                                            # Collects the time spent in each stage of a frame, disabled by default
         
         # Draw settings
         self.threshold_x_begin_px = 100
         self.threshold_y_begin_px = 40
         self.bar_distance_px = 150
         self.thickness_px = 3
+        self.strip_margin_px = 2                                                # Space left and right of the axes in images of lines between two axes
         self.axisHeight = 250
         #self.axisHeight = self.graphicsView.height() - 2 * self.threshold_y_begin_px 
         self.y_pos_start_px = self.threshold_y_begin_px
@@ -262,41 +1060,167 @@ class PCManager(object):
     def updateData(self, setProgress):
         self.data.fetchAllData(setProgress)
         
+    def setData(self, data):
+        """Replaces the current data at once, e.g. by data which has been loaded by a PCDataLoader"""
+        if data is not self.data:
+            self.data.clear() # Removes its temporary columns
+        data.pcManager = self
+        self.data = data
+        self.scheduleUpdate("data")
+        
     def removeData(self): # Clean up
-        self.data.attributeDict = dict()
-        self.data.attributeToPosition = dict()
-        self.data.positionToAttribute = dict()
-        self.data.featureDict = dict()
+        self.updateTimer.stop()
+        self.dirtyFlags.clear()
+        self.progressiveTimer.stop()
+        self.stripJobs.clear()
+        self.data.clear()
+        self.invalidateLayers()
         self.graphicsScene.clear()
         pass
+    
+    def scheduleUpdate(self, *flags):
+        """Marks the given changes ("data", "layout", "selection", "brushes", "visibility") as not drawn yet. They are drawn together with all other changes 
+        as soon as the event loop is idle, but not more often than maximumUpdateRate_hz times per second."""
+        if self.updateTimer.isActive():
+            self.coalescedRedraws += 1
+            self.profiler.count("redrawsCoalesced")
+        self.dirtyFlags.update(flags)
+        
+        if not self.updateTimer.isActive():
+            delay_ms = 1000.0 / self.maximumUpdateRate_hz - 1000.0 * (time.time() - self.lastUpdateTime)
+            self.updateTimer.start(max(0, int(delay_ms)))
+    
+    def flushUpdates(self):
+        """Draws all changes marked by scheduleUpdate at once"""
+        self.updateTimer.stop()
+        flags = self.dirtyFlags
+        self.dirtyFlags = set()
+        
+        if "data" in flags: # The mask versions of new data start from scratch, so cached images cannot be told apart
+            self.stripImages.clear()
+            self.previewStripImages.clear()
+            self.histograms.clear()
+            self.stripJobs.clear()
+        if "data" in flags or "layout" in flags: # The axes and all lines are at new positions
+            self.invalidateLayers()
+        if "brushes" in flags: # The brushed ranges are shown on the axes
+            self.invalidateLayers("axes")
+        if "selection" in flags:
+            self.invalidateLayers("selectedLines")
+        if "visibility" in flags:
+            self.invalidateLayers("lines", "selectedLines")
         
-    def setSelectedFeatures(self, idList):
-        for id_, feature in self.data.featureDict.items():
-                if (id_ in idList):
-                    feature.isSelected = True
-                else:
-                    feature.isSelected = False
-                
         self.drawParallelCoordinates()
+        self.lastUpdateTime = time.time()
+        
+    def setSelectedFeatures(self, idList):
+        """Selects the features in idList, e.g. after the selection was changed on the map canvas. The brushes no longer describe the selection then, so they are removed."""
+        with self.profiler.span("selection"):
+            changedRows = self.data.setSelectedMask(self.data.maskForIds(idList))
+        if changedRows is not None and len(changedRows) == 0: # Nothing changed, nothing to draw
+            return
+        
+        if len(self.data.brushes) > 0:
+            self.data.clearBrushes()
+            self.scheduleUpdate("brushes")
+        self.scheduleUpdate("selection")
     
     def setVisibleFeatures(self, idList):
-        for id_, feature in self.data.featureDict.items():
-                if (id_ in idList):
-                    feature.isVisible = True
-                else:
-                    feature.isVisible = False
-                
-        self.drawParallelCoordinates()
+        with self.profiler.span("visibility"):
+            mask = self.data.maskForIds(idList)
+        self.setVisibleMask(mask)
+    
+    def setVisibleRectangle(self, rectangle):
+        """Makes those features visible whose bounding boxes intersect rectangle, a (xMin, yMin, xMax, yMax) tuple, or all features if it is None.
+        Returns False without changing anything if the data has no spatial index."""
+        if self.data.spatialIndex is None:
+            return False
+        
+        with self.profiler.span("visibility"):
+            if rectangle is None:
+                mask = numpy.ones(self.data.featureCount(), dtype=bool)
+            else:
+                mask = self.data.spatialIndex.maskForRectangle(*rectangle)
+        self.setVisibleMask(mask)
+        return True
+    
+    def setVisibleMask(self, mask):
+        with self.profiler.span("visibility"):
+            changedRows = self.data.setVisibleMask(mask)
+        if changedRows is not None and len(changedRows) == 0:
+            return
+        
+        self.scheduleUpdate("visibility")
     
-    def setVisibleAttributes(self, idList): 
+    def setVisibleAttributes(self, idList, setProgress = None): 
         #print idList
+        # Columns are only loaded when they are shown for the first time
+        self.data.loadAttributes(idList, setProgress)
+        
         for id_ in self.data.attributeDict:
             isVisible = id_ in idList
             self.data.attributeDict[id_].isVisible = isVisible
                 
         self.data.evaluateAttributeVisibility()
     
-    def drawParallelCoordinates(self):
+    def invalidateLayers(self, *layers):
+        """Removes the given render layers ("axes", "lines", "selectedLines") from the cache, all of them if none is given"""
+        if len(layers) == 0:
+            self.layerImages.clear()
+            self.previewLayers.clear()
+            self.progressiveLayers.clear()
+        
+        for layer in layers:
+            if layer in self.layerImages:
+                del self.layerImages[layer]
+            self.previewLayers.discard(layer)
+            self.progressiveLayers.discard(layer)
+    
+    def beginInteraction(self):
+        """While interacting, lines are drawn from a sample of the visible features, which is chosen such that drawing takes about previewFrameBudget_ms"""
+        self.isInteracting = True
+        self.refineTimer.stop()
+        self.progressiveTimer.stop()
+    
+    def endInteraction(self):
+        """Restores the order of the axes if previewAxisMove was called, previews are replaced by full renderings after a short while"""
+        self.isInteracting = False
+        if self.savedPositions is not None:
+            self.data.setPositions(self.savedPositions)
+            self.savedPositions = None
+            self.scheduleUpdate("layout")
+        self.refineTimer.start()
+    
+    def previewAxisMove(self, firstPosition, secondPosition):
+        """Shows the axes as if the axis at firstPosition was moved to secondPosition, endInteraction restores the original order"""
+        if self.savedPositions is None:
+            self.savedPositions = dict(self.data.positionToAttribute)
+        
+        self.data.setPositions(self.savedPositions)
+        self.data.reorderAxes(firstPosition, secondPosition)
+        self.scheduleUpdate("layout")
+    
+    def refine(self):
+        """Replaces the render layers which were drawn from samples by full renderings"""
+        self.previewStripImages.clear()
+        if len(self.previewLayers) == 0: # Without layers invalidateLayers would remove all of them
+            return
+        
+        self.invalidateLayers(*self.previewLayers)
+        if len(self.layerImages) < 3:
+            self.drawParallelCoordinates(False)
+    
+    def sampleRows(self, rows):
+        """Returns a deterministic stratified sample of previewSampleSize of the given rows: they are divided into strata of equal size and the middle row of each stratum is taken"""
+        if len(rows) <= self.previewSampleSize:
+            return rows
+        
+        strata = (numpy.arange(self.previewSampleSize) + 0.5) * (len(rows) / float(self.previewSampleSize))
+        return rows[strata.astype(int)]
+    
+    def drawParallelCoordinates(self, allowPreview = True):
+        """Renders the layers which are not cached and composites all layers into the pixmap shown in the graphics scene.
+        While interacting, missing lines of unselected features are drawn from a sample unless allowPreview is False."""
         #print "drawing"
 
         # Recalculate axis height
@@ -316,48 +1240,380 @@ class PCManager(object):
         
         if numberVisibleAttributes < 2:
             #print "Too few attributes to be displayed. Aborting."
+            self.invalidateLayers()
+            self.profiler.finishFrame()
             return    
-    
+        
+        # The axes layer defines the size of all other layers
+        if "axes" not in self.layerImages:
+            with self.profiler.span("scene"):
+                self.createAxes()
+                
+                # The rectangle has to contain the origin or else the image is too small; it is aligned to whole pixels to avoid scaling
+                layerRect = QtCore.QRectF(self.graphicsScene.itemsBoundingRect().united(QtCore.QRectF(0, 0, 1, 1)).toAlignedRect())
+                if layerRect != self.layerRect:
+                    self.invalidateLayers()
+                    if layerRect.top() != self.layerRect.top() or layerRect.height() != self.layerRect.height():
+                        self.stripImages.clear()
+                    self.layerRect = layerRect
+                
+                self.layerImages["axes"] = self.renderScene(self.layerRect)
+        
+        # The line layers are composited from strip images, the time spent drawing missing strips counts as rasterize
+        if "lines" not in self.layerImages:
+            # Selected features are always drawn completely
+            preview = allowPreview and self.isInteracting and self.renderMode == "lines"
+            with self.profiler.span("composite"):
+                self.layerImages["lines"] = self.drawLineLayer(False, preview)
+        
+        if "selectedLines" not in self.layerImages:
+            with self.profiler.span("composite"):
+                self.layerImages["selectedLines"] = self.drawLineLayer(True)
+        
+        # Selected lines are drawn on top of all other lines
+        with self.profiler.span("composite"):
+            image = QtGui.QImage(self.layerRect.size().toSize(), QtGui.QImage.Format_ARGB32_Premultiplied)
+            image.fill(QtCore.Qt.transparent)
+            compositePainter = QtGui.QPainter(image)
+            for layer in ("axes", "lines", "selectedLines"):
+                compositePainter.drawImage(0, 0, self.layerImages[layer])
+            compositePainter.end()
+               
+            snapshot = QtGui.QPixmap.fromImage(image)
+               
+            self.graphicsScene.setSceneRect(self.layerRect)
+            self.pixmapItem = self.graphicsScene.addPixmap(snapshot)
+            self.pixmapItem.setPos(self.layerRect.topLeft())
+        
+        if self.profiler.isEnabled:
+            self.profiler.setCounter("featuresDrawn", int(numpy.count_nonzero(self.data.visibleMask)))
+        self.profiler.finishFrame()
+
+    def renderImage(self, background = QtCore.Qt.white):
+        """Draws all changes at once without previews or progressive rendering and returns the parallel coordinates as an image on the given background,
+        e.g. for batch jobs without a visible view. Returns None if less than two attributes are visible."""
+        self.isInteracting = False
+        self.refineTimer.stop()
+        self.progressiveTimer.stop()
+        self.stripJobs.clear()
+        unfinishedLayers = self.previewLayers | self.progressiveLayers
+        if len(unfinishedLayers) > 0:
+            self.invalidateLayers(*unfinishedLayers)
+
+        progressiveRendering = self.progressiveRendering
+        self.progressiveRendering = False
+        try:
+            self.flushUpdates()
+        finally:
+            self.progressiveRendering = progressiveRendering
 
-        self.createAxes()
-        self.createLines()
+        if len(self.layerImages) < 3:
+            return None
+
+        image = QtGui.QImage(self.layerRect.size().toSize(), QtGui.QImage.Format_ARGB32)
+        image.fill(background)
+        painter = QtGui.QPainter(image)
+        for layer in ("axes", "lines", "selectedLines"):
+            painter.drawImage(0, 0, self.layerImages[layer])
+        painter.end()
+        return image
+
+    def saveImage(self, fileName, background = QtCore.Qt.white):
+        """Renders the parallel coordinates like renderImage into an image file whose format is given by the extension of fileName, returns False if it fails"""
+        image = self.renderImage(background)
+        return image is not None and image.save(fileName)
+
+    def drawLineLayer(self, selectedOnly, preview = False):
+        """Composites the images of the lines between each pair of adjacent axes into the image of a line layer. 
+        These images are cached by the attributes of the axes and the versions of the masks they depend on, 
+        so after moving an axis only the pairs of axes which did not exist before are rendered.
+        If preview is True, missing images are drawn from a sample of the features and not cached. 
+        Otherwise they are rendered progressively if progressiveRendering is True and the images drawn so far are used."""
+        image = QtGui.QImage(self.layerRect.size().toSize(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.transparent)
+        compositePainter = QtGui.QPainter(image)
+        
+        if selectedOnly:
+            maskVersions = (self.data.visibleVersion, self.data.selectedVersion)
+        else:
+            maskVersions = (self.data.visibleVersion, None)
+        
+        for position in range(len(self.data.positionToAttribute)-1):
+            leftAttribute = self.data.positionToAttribute[position]
+            rightAttribute = self.data.positionToAttribute[position+1]
+            
+            # Antialiasing is not symmetric, so the lines between two axes in reversed order are rendered on their own instead of mirrored
+            key = (leftAttribute, rightAttribute, selectedOnly, maskVersions)
+            if key in self.stripImages:
+                strip = self.stripImages[key]
+            elif preview:
+                if key not in self.previewStripImages:
+                    startTime = time.time()
+                    self.previewStripImages[key] = self.renderStrip(position, selectedOnly, self.sampleRows(self.lineRows(selectedOnly)))
+                    self.adaptPreviewSampleSize(time.time() - startTime)
+                strip = self.previewStripImages[key]
+                self.previewLayers.add("selectedLines" if selectedOnly else "lines")
+            elif self.progressiveRendering and self.renderMode == "lines" and self.renderBackend == "painter":
+                if key not in self.stripJobs:
+                    self.stripJobs[key] = PCStripJob(self.createStripImage(), self.lineRows(selectedOnly))
+                strip = self.stripJobs[key].image
+                self.progressiveLayers.add("selectedLines" if selectedOnly else "lines")
+            else:
+                strip = self.renderStrip(position, selectedOnly)
+                self.stripImages[key] = strip
+            
+            x_pos_px = self.threshold_x_begin_px + self.bar_distance_px*position - self.strip_margin_px
+            compositePainter.drawImage(QtCore.QPointF(x_pos_px - self.layerRect.left(), 0), strip)
+        
+        compositePainter.end()
+        
+        if preview:
+            self.refineTimer.start()
+        elif len(self.stripJobs) > 0 and not self.isInteracting:
+            self.progressiveTimer.start(0)
+        
+        # Images and histograms for outdated masks will not be used again
+        for cache in (self.stripImages, self.previewStripImages, self.histograms):
+            for key in list(cache):
+                if key[2] == selectedOnly and key[3] != maskVersions:
+                    del cache[key]
+        
+        # Jobs for pairs of axes which are no longer adjacent are given up
+        if not preview:
+            keys = self.stripKeys(selectedOnly, maskVersions)
+            for key in list(self.stripJobs):
+                if key[2] == selectedOnly and key not in keys:
+                    del self.stripJobs[key]
+        
+        return image
+    
+    def stripKeys(self, selectedOnly, maskVersions):
+        """Returns the keys of the strip images of the current order of the axes, see drawLineLayer"""
+        keys = set()
+        for position in range(len(self.data.positionToAttribute)-1):
+            leftAttribute = self.data.positionToAttribute[position]
+            rightAttribute = self.data.positionToAttribute[position+1]
+            keys.add((leftAttribute, rightAttribute, selectedOnly, maskVersions))
+        return keys
+    
+    def renderStripChunks(self):
+        """Draws chunks of progressiveChunkSize lines into the images of the strip jobs until progressiveFrameBudget_ms is used up.
+        Finished images are cached like fully rendered ones and the line layers are composited again to show the progress."""
+        deadline = time.time() + self.progressiveFrameBudget_ms / 1000.0
+        for key in sorted(self.stripJobs, key = lambda key: not key[2]): # Selected lines first, there are usually less of them
+            job = self.stripJobs[key]
+            while job.nextRow < len(job.rows) and time.time() < deadline:
+                rows = job.rows[job.nextRow:job.nextRow + self.progressiveChunkSize]
+                with self.profiler.span("rasterize"):
+                    self.paintStripLines(job.image, key[0], key[1], rows, key[2])
+                job.nextRow += len(rows)
+            
+            if job.nextRow >= len(job.rows):
+                self.stripImages[key] = job.image
+                del self.stripJobs[key]
+            if time.time() >= deadline:
+                break
+        
+        if len(self.progressiveLayers) > 0: # Without layers invalidateLayers would remove all of them
+            self.invalidateLayers(*self.progressiveLayers)
+        self.drawParallelCoordinates(False)
+    
+    def adaptPreviewSampleSize(self, elapsedTime):
+        """Scales the sample size such that drawing a strip of a preview takes an equal share of previewFrameBudget_ms"""
+        stripBudget = self.previewFrameBudget_ms / 1000.0 / max(1, len(self.data.positionToAttribute) - 1)
+        if elapsedTime > 0:
+            sampleSize = self.previewSampleSize * stripBudget / elapsedTime
+            self.previewSampleSize = int(min(max(sampleSize, 1000), 1000000))
+    
+    def renderStrip(self, position, selectedOnly, rows = None):
+        """Renders the lines between the axes at position and position+1 into an image of the height of the layers.
+        By default, the lines of all features given by lineRows are drawn, otherwise those of the given rows."""
+        x_pos_px = self.threshold_x_begin_px + self.bar_distance_px*position - self.strip_margin_px
+        stripRect = QtCore.QRectF(x_pos_px, self.layerRect.top(), self.bar_distance_px + 2*self.strip_margin_px, self.layerRect.height())
+        
+        if self.renderMode == "density":
+            with self.profiler.span("rasterize"):
+                return self.renderDensityStrip(position, selectedOnly, stripRect)
+        
+        if rows is None:
+            rows = self.lineRows(selectedOnly)
+        
+        if self.renderBackend == "scene":
+            with self.profiler.span("scene"):
+                self.createLines(selectedOnly, position, rows)
+            with self.profiler.span("rasterize"):
+                return self.renderScene(stripRect)
+        
+        with self.profiler.span("rasterize"):
+            image = self.createStripImage()
+            self.paintStripLines(image, self.data.positionToAttribute[position], self.data.positionToAttribute[position+1], rows, selectedOnly)
+        return image
+    
+    def createStripImage(self):
+        """Returns a transparent image for the lines between two axes"""
+        image = QtGui.QImage(self.bar_distance_px + 2*self.strip_margin_px, self.layerRect.toRect().height(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.transparent)
+        return image
+    
+    def paintStripLines(self, image, leftAttribute, rightAttribute, rows, selectedOnly):
+        """Draws the lines of the given rows between the axes of leftAttribute and rightAttribute into the image of a strip.
+        If there are enough lines, they are divided into consecutive shards which are drawn by the render pool and composited in order."""
+        pen = self.linePen(selectedOnly)
+        self.profiler.count("segmentsDrawn", len(rows))
+        
+        # The rows are drawn in chunks, so the positions and lines of all rows are never held at once
+        chunkSize = self.data.chunkSize()
+        for first in range(0, len(rows), chunkSize):
+            chunkRows = rows[first:first+chunkSize]
+            yLeft = self.axisPositions(leftAttribute, chunkRows)
+            yRight = self.axisPositions(rightAttribute, chunkRows)
+            
+            shardCount = min(self.renderThreads, len(chunkRows) // self.minimumShardSize)
+            if self.renderPool is None or shardCount < 2:
+                self.paintLines(image, yLeft, yRight, pen)
+                continue
+            
+            # Compositing the shards in order keeps the order in which the lines overlap
+            shards = numpy.array_split(numpy.arange(len(chunkRows)), shardCount)
+            shardImages = self.renderPool.map(lambda shard: self.paintLines(self.createStripImage(), yLeft[shard], yRight[shard], pen), shards)
+            compositePainter = QtGui.QPainter(image)
+            for shardImage in shardImages:
+                compositePainter.drawImage(0, 0, shardImage)
+            compositePainter.end()
+    
+    def paintLines(self, image, yLeft, yRight, pen):
+        """Draws lines from the y positions in yLeft on the left axis to those in yRight on the right axis into the image of a strip and returns it.
+        As only the image is changed, this may run in a different thread."""
+        x_left_px = self.strip_margin_px
+        x_right_px = x_left_px + self.bar_distance_px
+        lines = [QtCore.QLineF(x_left_px, y_left_px, x_right_px, y_right_px) for y_left_px, y_right_px in zip(yLeft.tolist(), yRight.tolist())]
+        
+        # All lines are drawn by a single call directly into the image
+        stripPainter = QtGui.QPainter(image)
+        stripPainter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+        stripPainter.translate(0, -self.layerRect.top())
+        stripPainter.setPen(pen)
+        stripPainter.drawLines(lines)
+        stripPainter.end()
+        return image
+    
+    def setRenderThreads(self, renderThreads):
+        """Sets the number of threads drawing the lines of a strip, 1 draws them serially. All cached strip images are kept, as they do not depend on it."""
+        if self.renderPool is not None:
+            self.renderPool.close()
+            self.renderPool = None
+        
+        self.renderThreads = max(1, renderThreads)
+        if self.renderThreads > 1:
+            self.renderPool = ThreadPool(self.renderThreads)
+    
+    def renderDensityStrip(self, position, selectedOnly, stripRect):
+        """Renders the line density between the axes at position and position+1 into an image. One line is drawn between the centers of each 
+        pair of bins containing features, its opacity is given by the transfer function applied to the number of these features."""
+        image = QtGui.QImage(stripRect.size().toSize(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.transparent)
+        
+        counts = self.pairHistogram(position, selectedOnly)
+        maxCount = counts.max() if counts.size > 0 else 0
+        if maxCount == 0:
+            return image
+        
+        leftBins, rightBins = numpy.nonzero(counts)
+        self.profiler.count("segmentsDrawn", len(leftBins))
+        opacities = self.densityOpacities(counts[leftBins, rightBins], maxCount)
+        
+        # Lines are drawn once per opacity level, the densest ones on top
+        levels = numpy.clip(numpy.round(opacities * 255), 1, 255).astype(int)
+        binCenters = self.y_pos_start_px + (self.y_pos_end_px - self.y_pos_start_px)*(1 - (numpy.arange(self.densityBins) + 0.5) / self.densityBins)
+        x_left_px = self.threshold_x_begin_px + self.bar_distance_px*position
+        x_right_px = x_left_px + self.bar_distance_px
+        
+        stripPainter = QtGui.QPainter(image)
+        stripPainter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+        stripPainter.translate(-stripRect.left(), -stripRect.top())
+        color = self.linePen(selectedOnly).color()
+        for level in numpy.unique(levels).tolist():
+            isLevel = levels == level
+            yLeftList = binCenters[leftBins[isLevel]].tolist()
+            yRightList = binCenters[rightBins[isLevel]].tolist()
+            
+            color.setAlpha(level)
+            stripPainter.setPen(QtGui.QPen(color))
+            stripPainter.drawLines([QtCore.QLineF(x_left_px, y_left_px, x_right_px, y_right_px) for y_left_px, y_right_px in zip(yLeftList, yRightList)])
+        stripPainter.end()
+        
+        return image
+    
+    def pairHistogram(self, position, selectedOnly):
+        """Returns the 2D histogram of the normalized values on the axes at position (first index) and position+1 (second index)"""
+        leftAttribute = self.data.positionToAttribute[position]
+        rightAttribute = self.data.positionToAttribute[position+1]
+        if selectedOnly:
+            maskVersions = (self.data.visibleVersion, self.data.selectedVersion)
+        else:
+            maskVersions = (self.data.visibleVersion, None)
+        
+        # Histograms are held for the attributes in ascending order and transposed for the reversed order
+        key = (min(leftAttribute, rightAttribute), max(leftAttribute, rightAttribute), selectedOnly, maskVersions)
+        if key not in self.histograms:
+            rows = self.lineRows(selectedOnly)
+            counts = numpy.zeros(self.densityBins*self.densityBins, dtype=numpy.int64)
+            chunkSize = self.data.chunkSize()
+            for first in range(0, len(rows), chunkSize):
+                chunkRows = rows[first:first+chunkSize]
+                lowerBins = self.densityBinIndices(key[0], chunkRows)
+                upperBins = self.densityBinIndices(key[1], chunkRows)
+                counts += numpy.bincount(lowerBins * self.densityBins + upperBins, minlength=self.densityBins*self.densityBins)
+            self.histograms[key] = counts.reshape(self.densityBins, self.densityBins)
+        
+        if rightAttribute < leftAttribute:
+            return self.histograms[key].T
+        return self.histograms[key]
+    
+    def densityBinIndices(self, attribute, rows):
+        bins = (self.data.normalizedColumns[attribute][rows] * self.densityBins).astype(int)
+        return numpy.clip(bins, 0, self.densityBins - 1)
     
-        # This fixes a bug which leads to an image which is too small
-        if self.initialized == False:
-            self.initialized = True
-            pen = QtGui.QPen(QtCore.Qt.white)
-            self.graphicsScene.addEllipse(0, 0, 1, 1, pen)    
-           
-           
+    def densityOpacities(self, counts, maxCount):
+        if callable(self.densityTransferFunction):
+            return numpy.clip(self.densityTransferFunction(counts, maxCount), 0.0, 1.0)
+        if self.densityTransferFunction == "linear":
+            return counts / float(maxCount)
+        if self.densityTransferFunction == "sqrt":
+            return numpy.sqrt(counts / float(maxCount))
+        return numpy.log1p(counts) / numpy.log1p(maxCount)
+    
+    def setRenderMode(self, renderMode, densityTransferFunction = None):
+        """Switches between "lines" and "density" rendering; the histograms of the density rendering are kept, so changing the transfer function only recolors them"""
+        self.renderMode = renderMode
+        if densityTransferFunction is not None:
+            self.densityTransferFunction = densityTransferFunction
+        
+        # Lines which are still rendered progressively would end up in the strip images of the other mode
+        self.progressiveTimer.stop()
+        self.stripJobs.clear()
+        self.stripImages.clear()
+        self.progressiveLayers.clear()
+        self.invalidateLayers("lines", "selectedLines")
+        self.scheduleUpdate()
+    
+    def setDensityBins(self, densityBins):
+        self.densityBins = densityBins
+        self.histograms.clear()
+        self.setRenderMode(self.renderMode)
+    
+    def renderScene(self, rect):
+        """Renders the items of the graphics scene inside rect into an image and clears the graphics scene"""
         # Approach do draw everything into an image
-        image = QtGui.QImage(self.graphicsScene.sceneRect().size().toSize(), QtGui.QImage.Format_ARGB32)
-        #print image.width()
-        #print image.height()
+        image = QtGui.QImage(rect.size().toSize(), QtGui.QImage.Format_ARGB32_Premultiplied)
         image.fill(QtCore.Qt.transparent) # Seems to be needed or else artifacts occur (https://github.com/ariya/phantomjs/issues/11366)
         snapshotPainter = QtGui.QPainter(image)
         snapshotPainter.setRenderHint(QtGui.QPainter.Antialiasing, True)
-        self.graphicsScene.render(snapshotPainter)
+        self.graphicsScene.render(snapshotPainter, QtCore.QRectF(image.rect()), rect)
         snapshotPainter.end() # I need this for (local?) variables of QImage or else qgis will break
-           
-        self.graphicsScene.clear()
-        #print self.graphicsScene.sceneRect()
-           
-        snapshot = QtGui.QPixmap.fromImage(image)
-           
-        self.pixmapItem = self.graphicsScene.addPixmap(snapshot)
-    
-        
         
-        #print self.pixmapItem.boundingRect()
-        #pen = QtGui.QPen(QtCore.Qt.red)
-        # First Axis
-        #self.graphicsScene.addEllipse(self.threshold_x_begin_px, self.y_pos_start_px, 10, 10, pen)
-        #self.graphicsScene.addEllipse(self.threshold_x_begin_px, self.y_pos_end_px, 10, 10, pen)
-        
-        # Second Axis
-        #self.graphicsScene.addEllipse(self.threshold_x_begin_px + self.bar_distance_px, self.y_pos_start_px, 10, 10, pen)
-        #self.graphicsScene.addEllipse(self.threshold_x_begin_px + self.bar_distance_px, self.y_pos_end_px, 10, 10, pen)
-        #image.save("/home/heitzler/_Junk/pixmap.png", "PNG") # For testing
+        self.graphicsScene.clear()
+        return image
     
     def createAxes(self):
         for attributeId in self.data.attributeToPosition:
@@ -380,6 +1636,16 @@ class PCManager(object):
             nameLabel.setPos(x_pos_px-20, self.y_pos_start_px-32)
             self.graphicsScene.addItem(nameLabel);
     
+            # Brushed range
+            for brush in self.data.brushes:
+                if brush.attributeId == attributeId:
+                    y_max_px = self.y_pos_start_px + (self.y_pos_end_px - self.y_pos_start_px)*(1-brush.maximum)
+                    y_min_px = self.y_pos_start_px + (self.y_pos_end_px - self.y_pos_start_px)*(1-brush.minimum)
+                    brushRect = QtGui.QGraphicsRectItem(x_pos_px-6, y_max_px, 12, y_min_px - y_max_px)
+                    brushRect.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+                    brushRect.setBrush(QtGui.QColor(255, 0, 0, 64))
+                    self.graphicsScene.addItem(brushRect)
+    
             if attribute.scale == "numerical": # min and max labels only for numerical data
     
                 # Min label
@@ -400,42 +1666,49 @@ class PCManager(object):
         pass
     
 
-    def createLines(self):        
-        for id_, feature in self.data.featureDict.items():
-            #print "id: " + str(id_)
-            #print self.data.featureDict[id_].isSelected
-            
-            # Does not need to be processed
-            if feature.isVisible == False:
+    def lineRows(self, selectedOnly):
+        """Returns the rows of all visible features or, if selectedOnly is True, of all visible and selected features"""
+        if selectedOnly:
+            return numpy.flatnonzero(self.data.visibleMask & self.data.selectedMask)
+        return numpy.flatnonzero(self.data.visibleMask)
+    
+    def axisPositions(self, attribute, rows):
+        """Returns the y positions on the axis of attribute for the given rows"""
+        return self.y_pos_start_px + (self.y_pos_end_px - self.y_pos_start_px)*(1-self.data.normalizedColumns[attribute][rows])
+    
+    def linePen(self, selectedOnly):
+        pen = QtGui.QPen(QtCore.Qt.black)
+        if selectedOnly:
+            pen.setBrush(QtCore.Qt.red)
+        return pen
+    
+    def createLines(self, selectedOnly, firstPosition = None, rows = None):
+        """Adds the lines of all visible features or, if selectedOnly is True, of all visible and selected features to the graphics scene.
+        If firstPosition is given, only the lines between the axes at firstPosition and firstPosition+1 are added. 
+        If rows is given, only the lines of these rows are added."""
+        # Only visible features need to be processed
+        if rows is None:
+            rows = self.lineRows(selectedOnly)
+        if len(rows) == 0:
+            return
+        
+        # Calculate the positions on all axes for all features at once
+        xList = list()
+        yColumns = list()
+        for position, attribute in sorted(self.data.positionToAttribute.items()):
+            if firstPosition is not None and position not in (firstPosition, firstPosition+1):
                 continue
-            # Default z value is 0.0 and 1.0 if selected
-            z = 0.0
-            #print "Selection"
-            pen = QtGui.QPen(QtCore.Qt.black)
-            if feature.isSelected == True:
-                z = 1.0
-                #print "isSelected"
-                pen.setBrush(QtCore.Qt.red)
-        
-            # List to store the points on the axes in
-            pointList = []
-            for position,attribute in self.data.positionToAttribute.items():
-                # Calculate position on axis
-                x_pos_px = self.threshold_x_begin_px + self.bar_distance_px*position
-                y_pos_px = self.y_pos_start_px + (self.y_pos_end_px - self.y_pos_start_px)*(1-feature.normalizedAttributeValues[attribute])
-             
-                pointList.append(QtCore.QPointF(x_pos_px, y_pos_px))
-            
-            lineList = []
-            for index in range(0,len(pointList)-1):
-                line = QtCore.QLineF(pointList[index], pointList[index+1])
+            xList.append(self.threshold_x_begin_px + self.bar_distance_px*position)
+            yColumns.append(self.axisPositions(attribute, rows).tolist())
+        
+        pen = self.linePen(selectedOnly)
+        
+        for index in range(len(rows)):
+            for axisIndex in range(0, len(xList)-1):
+                line = QtCore.QLineF(xList[axisIndex], yColumns[axisIndex][index], xList[axisIndex+1], yColumns[axisIndex+1][index])
                 graphicsLine = QtGui.QGraphicsLineItem(line)
-                graphicsLine.setZValue(z)
                 graphicsLine.setPen(pen)
-                lineList.append(graphicsLine)
                 self.graphicsScene.addItem(graphicsLine)
-             
-            pass
 
     def getAxisByRectangle(self, startPointScene, endPointScene):
         attribute = -1
@@ -480,7 +1753,9 @@ class PCManager(object):
         return -1
         pass
       
-    def rectangleSelection(self, startPointScene, endPointScene):
+    def rectangleSelection(self, startPointScene, endPointScene, operation = None):
+        """Brushes the part of the axis inside the rectangle. If operation is None, all other brushes are removed, 
+        otherwise the brush is combined with the other brushes by operation ("and", "or" or "not")"""
     
         attribute = self.getAxisByRectangle(startPointScene, endPointScene)
         if attribute == -1:
@@ -497,24 +1772,32 @@ class PCManager(object):
         selectionValueMin = (startPointScene.y() - self.threshold_y_begin_px) / (self.axisHeight - 2 * self.threshold_y_begin_px)
         selectionValueMax = (endPointScene.y() - self.threshold_y_begin_px) / (self.axisHeight - 2 * self.threshold_y_begin_px)
 
-        idList = list()
+        if operation is None:
+            self.data.clearBrushes()
+            operation = "and"
         
-        # Select brushed features
-        for id, feature in self.data.featureDict.items():
-                       
-            normalizedValue = 1.0-feature.normalizedAttributeValues[attribute] 
-            
-            if normalizedValue >= selectionValueMin and normalizedValue <= selectionValueMax:
-                feature.isSelected = True
-                idList.append(id)
-            else:
-                feature.isSelected = False
+        # Select brushed features, the axis is directed upwards
+        with self.profiler.span("selection"):
+            selectedMask = self.data.setBrush(attribute, 1.0-selectionValueMax, 1.0-selectionValueMin, operation)
+            changedRows = self.data.setSelectedMask(selectedMask)
+        
+        # The brushed range is shown on the axes, so they are drawn in any case
+        if changedRows is not None and len(changedRows) == 0:
+            self.scheduleUpdate("brushes")
+            return
         
-        self.setSelectedFeatures(idList)
-        self.data.dataInterface.setSelectedFeatures(idList)
+        self.scheduleUpdate("brushes", "selection")
+        with self.profiler.span("selection"):
+            self.data.dataInterface.setSelectedFeatures(self.data.featureIds[selectedMask].tolist())
         pass
       
       
+    def setProfileOverlay(self, isShown):
+        """Shows the time spent in each stage of the last frame and its counters in the corner of the view, profiling is enabled while it is shown"""
+        self.profiler.isEnabled = isShown
+        self.graphicsView.showsProfile = isShown
+        self.graphicsView.viewport().update()
+    
     def getWidget(self):
         """Returns the widget in which the parallel coordinates are drawn"""
         return self.graphicsView
@@ -540,6 +1823,8 @@ class PCGraphicsView(QtGui.QGraphicsView):
         self.mouseCurrentPosX = 0
         self.mouseCurrentPosY = 0
         
+        self.showsProfile = False   # Shows the last frame of the profiler of pcManager, see PCManager.setProfileOverlay
+        
         pass
     
     def paintEvent(self, paintEvent):
@@ -569,9 +1854,25 @@ class PCGraphicsView(QtGui.QGraphicsView):
 
                 line = QtCore.QLine(axisStartPoint, axisEndPoint)
                 painter.drawLine(line)
+        
+        if self.showsProfile and self.pcManager.profiler.lastFrame is not None:
+            self.drawProfile(painter)
             
         pass
     
+    def drawProfile(self, painter):
+        """Draws the stages and counters of the last frame of the profiler into the top left corner of the viewport"""
+        text = self.pcManager.profiler.formatFrame(self.pcManager.profiler.lastFrame, "\n")
+        font = painter.font()
+        font.setPointSize(8)
+        painter.setFont(font)
+        
+        textRect = painter.fontMetrics().boundingRect(QtCore.QRect(0, 0, self.viewport().width(), self.viewport().height()), QtCore.Qt.AlignLeft, text)
+        textRect.translate(6, 6)
+        painter.fillRect(textRect.adjusted(-4, -4, 4, 4), QtGui.QColor(255, 255, 255, 200))
+        painter.setPen(QtGui.QPen(QtCore.Qt.black))
+        painter.drawText(textRect, QtCore.Qt.AlignLeft, text)
+    
     def mousePressEvent(self, event):
         super(PCGraphicsView, self).mousePressEvent(event)
         startPointScene = super(PCGraphicsView, self).mapToScene(QtCore.QPoint(event.x(), event.y()))
@@ -581,6 +1882,7 @@ class PCGraphicsView(QtGui.QGraphicsView):
             self.currentState = "SelectionRectangle"
         else:
             self.currentState = "AxisSwitchLine"
+            self.pcManager.beginInteraction()
             
         self.drawingState = True
         self.selectionStartX = event.x()
@@ -597,11 +1899,19 @@ class PCGraphicsView(QtGui.QGraphicsView):
             
             if self.currentState == "AxisSwitchLine":
                 point = super(PCGraphicsView, self).mapToScene(QtCore.QPoint(self.mouseCurrentPosX, self.mouseCurrentPosY))
-                self.gapAxis = self.pcManager.getGapByPoint(point)
-                if self.gapAxis == -1:
-                    self.gapAxis = self.pcManager.getAxisByPoint(point)
+                gapAxis = self.pcManager.getGapByPoint(point)
+                if gapAxis == -1:
+                    gapAxis = self.pcManager.getAxisByPoint(point)
                 else:
-                    self.gapAxis += 0.5 # adjustment for gaps for use as multiplier
+                    gapAxis += 0.5 # adjustment for gaps for use as multiplier
+                
+                # Preview the new order of the axes
+                if gapAxis != self.gapAxis:
+                    self.gapAxis = gapAxis
+                    if self.gapAxis == -1:
+                        self.pcManager.previewAxisMove(self.clickedAxis, self.clickedAxis)
+                    else:
+                        self.pcManager.previewAxisMove(self.clickedAxis, self.gapAxis)
                 
             self.repaint()
             
@@ -638,10 +1948,23 @@ class PCGraphicsView(QtGui.QGraphicsView):
             startPointScene = super(PCGraphicsView, self).mapToScene(startPoint)
             endPointScene = super(PCGraphicsView, self).mapToScene(endPoint)
     
-            self.pcManager.rectangleSelection(startPointScene, endPointScene)
+            # Modifiers combine the brush with the existing brushes instead of replacing them
+            operation = None
+            if event.modifiers() & QtCore.Qt.ShiftModifier:
+                operation = "and"
+            elif event.modifiers() & QtCore.Qt.ControlModifier:
+                operation = "or"
+            elif event.modifiers() & QtCore.Qt.AltModifier:
+                operation = "not"
+    
+            self.pcManager.rectangleSelection(startPointScene, endPointScene, operation)
             
-        elif self.currentState == "AxisSwitchLine" and self.clickedAxis != -1 and self.gapAxis != -1:
-            self.pcManager.data.moveAxes(self.clickedAxis, self.gapAxis)
+        elif self.currentState == "AxisSwitchLine":
+            self.pcManager.endInteraction()
+            if self.clickedAxis != -1 and self.gapAxis != -1:
+                self.pcManager.data.moveAxes(self.clickedAxis, self.gapAxis)
+            else:
+                self.pcManager.scheduleUpdate()
         
         # Reset
         self.clickedAxis = -1
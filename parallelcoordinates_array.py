@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ ParallelCoordinates_Plugin
+                                 A QGIS plugin
+ Allows interactive visual analysis using parallel coordinates.
+                              -------------------
+        begin                : 2014-06-28
+        copyright            : (C) 2014 by Magnus Heitzler
+        email                : magnus.heitzler@gmx.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import collections
+import numbers
+import numpy
+
+from parallelcoordinates import PCDataInterface
+
+class PCArrayDataInterface(PCDataInterface):
+    """This concrete class implements the abstract functions defined by PCDataInterface for columns held in memory, e.g. NumPy arrays.
+    It needs neither QGIS nor a data provider, so PCManager can be used in batch jobs; a QApplication has to exist nevertheless,
+    e.g. one using the offscreen platform. PCManager.saveImage renders the parallel coordinates to an image file."""
+    def __init__(self, columns = None, ids = None, selectedIds = None, bounds = None):
+        PCDataInterface.__init__(self)
+
+        self.names = list()                 # Names of the attributes, their ids are their positions in this list
+        self.columns = dict()               # Dictionary of attribute ids and arrays of their values, float arrays with NaN for NULL are numerical, object arrays with None for NULL are categorical
+        self.featureIds = numpy.zeros(0, dtype=numpy.int64)
+        self.bounds = None                  # Array holding xMin, yMin, xMax, yMax of each feature (NaN without geometry) or None
+        self.selectedFeatureIds = set()
+        self.attributeIndex = -1
+        self.nextRow = 0
+
+        if columns is not None:
+            self.setColumns(columns, ids, selectedIds, bounds)
+
+    def setColumns(self, columns, ids = None, selectedIds = None, bounds = None):
+        """Replaces the data by columns, a list of (name, values) tuples or a dictionary of names and values, whose attributes are ordered by name
+        unless it is an OrderedDict. Numbers become numerical attributes, all other values categorical ones; None and NaN stand for NULL.
+        The feature ids default to the row numbers; bounds is an optional sequence of (xMin, yMin, xMax, yMax) tuples used by setVisibleRectangle."""
+        if isinstance(columns, collections.OrderedDict):
+            columns = list(columns.items())
+        elif isinstance(columns, dict):
+            columns = sorted(columns.items())
+
+        self.names = list()
+        self.columns = dict()
+        for attributeId, (name, values) in enumerate(columns):
+            self.names.append(name)
+            self.columns[attributeId] = self.createColumn(values)
+
+        featureCount = len(self.columns[0]) if len(self.columns) > 0 else 0
+        if ids is None:
+            ids = numpy.arange(featureCount)
+        self.featureIds = numpy.asarray(ids, dtype=numpy.int64)
+
+        self.bounds = None
+        if bounds is not None:
+            self.bounds = numpy.asarray(bounds, dtype=float).reshape(-1, 4)
+
+        for array in [self.featureIds] + list(self.columns.values()) + ([self.bounds] if self.bounds is not None else []):
+            if len(array) != featureCount:
+                raise ValueError("All columns, the ids and the bounds must have the same length")
+
+        self.selectedFeatureIds = set(selectedIds) if selectedIds is not None else set()
+        self.attributeIndex = -1
+        self.nextRow = 0
+
+    def createColumn(self, values):
+        """Returns values as float array with NaN for NULL if they are numbers, otherwise as object array with None for NULL"""
+        array = numpy.asarray(values)
+        if array.dtype.kind in "biuf":
+            return array.astype(float)
+
+        array = numpy.asarray(values, dtype=object).reshape(-1)
+        isNull = numpy.array([value is None or (isinstance(value, float) and value != value) for value in array.tolist()], dtype=bool)
+        if all(isinstance(value, numbers.Number) for value in array[~isNull].tolist()):
+            column = numpy.empty(len(array), dtype=float)
+            column.fill(numpy.nan)
+            column[~isNull] = array[~isNull].astype(float)
+            return column
+
+        array[isNull] = None
+        return array
+
+    def featureCount(self):
+        return len(self.featureIds)
+
+    def nextAttribute(self, attribute):
+        self.attributeIndex += 1
+        if self.attributeIndex == len(self.names):
+            self.attributeIndex = -1
+            return False
+
+        attribute.id = self.attributeIndex
+        attribute.name = self.names[self.attributeIndex]
+        attribute.isVisible = True
+
+        column = self.columns[self.attributeIndex]
+        if column.dtype.kind == "f":
+            attribute.scale = "numerical"
+            attribute.unit = "unknown"
+            isNotNull = ~numpy.isnan(column)
+            attribute.minimum = float(column[isNotNull].min()) if isNotNull.any() else 0.0
+            attribute.maximum = float(column[isNotNull].max()) if isNotNull.any() else 0.0
+        else:
+            attribute.scale = "categorical" # PCData compares the values as strings
+            attribute.uniqueValues = sorted(set(str(value) for value in column.tolist() if value is not None))
+            attribute.numberUniqueValues = len(attribute.uniqueValues)
+
+        return True
+
+    def nextFeature(self, feature):
+        if self.nextRow >= len(self.featureIds):
+            self.nextRow = 0
+            return False
+
+        row = self.nextRow
+        self.nextRow += 1
+
+        feature.id = int(self.featureIds[row])
+        feature.isSelected = feature.id in self.selectedFeatureIds
+        feature.isVisible = True
+        feature.attributeValues = dict((attributeId, self.value(attributeId, row)) for attributeId in self.columns)
+        feature.normalizedAttributeValues = {}
+        return True
+
+    def value(self, attributeId, row):
+        value = self.columns[attributeId][row]
+        if isinstance(value, float) and value != value: # NaN
+            return None
+        return value
+
+    def supportsFeatureBatches(self):
+        return True
+
+    def supportsBounds(self):
+        return self.bounds is not None
+
+    def nextFeatureBatch(self, batch, attributeIds, batchSize, withBounds = False):
+        if self.nextRow >= len(self.featureIds):
+            self.nextRow = 0
+            return False
+
+        rows = slice(self.nextRow, min(self.nextRow + batchSize, len(self.featureIds)))
+        self.nextRow = rows.stop
+
+        batch.ids = self.featureIds[rows].tolist()
+        batch.isSelected = [id_ in self.selectedFeatureIds for id_ in batch.ids]
+        batch.isVisible = [True] * len(batch.ids)
+        batch.attributeValues = dict((attributeId, self.columns[attributeId][rows].tolist()) for attributeId in attributeIds) # NaN stands for NULL numbers
+        batch.bounds = None
+        if withBounds and self.bounds is not None:
+            batch.bounds = [None if box[0] != box[0] else tuple(box) for box in self.bounds[rows].tolist()]
+        return True
+
+    def finished(self):
+        self.attributeIndex = -1
+        self.nextRow = 0
+
+    def getSelectedFeatureIds(self):
+        return self.selectedFeatureIds
+
+    def setSelectedFeatures(self, idList):
+        self.selectedFeatureIds = set(idList)
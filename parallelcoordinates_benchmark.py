@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ ParallelCoordinates_Plugin
+                                 A QGIS plugin
+ Allows interactive visual analysis using parallel coordinates.
+                              -------------------
+        begin                : 2014-06-28
+        copyright            : (C) 2014 by Magnus Heitzler
+        email                : magnus.heitzler@gmx.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Benchmarks the stages of PCData and PCManager on synthetic data without QGIS, using the offscreen Qt platform:
+
+    python parallelcoordinates_benchmark.py --output results.json
+    python parallelcoordinates_benchmark.py --baseline results.json
+
+Each dataset is benchmarked in a process of its own, so the peak memory is that of the dataset alone.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import collections
+import numpy
+
+STAGES = ("generate", "load", "columns", "normalize", "render", "brush", "reorder")
+
+def generateColumns(featureCount, attributeCount, nullShare, seed = 0):
+    """Returns an OrderedDict of attribute names and values, every fourth attribute is categorical and about nullShare of all values are NULL"""
+    random = numpy.random.RandomState(seed)
+    categories = numpy.array(["category %d" % index for index in range(12)] + [None], dtype=object)
+    columns = collections.OrderedDict()
+    for attributeIndex in range(attributeCount):
+        isNull = random.random_sample(featureCount) < nullShare
+        if attributeIndex % 4 == 3:
+            codes = random.randint(0, len(categories) - 1, featureCount)
+            codes[isNull] = len(categories) - 1
+            columns["categorical_%d" % attributeIndex] = categories[codes]
+        else:
+            values = random.normal(attributeIndex, 1.0 + attributeIndex, featureCount)
+            values[isNull] = numpy.nan
+            columns["numerical_%d" % attributeIndex] = values
+    return columns
+
+def benchmarkDataset(featureCount, attributeCount, nullShare, repeat):
+    """Runs all stages on one synthetic dataset and returns the shortest time of each stage in seconds and the peak memory"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt4 import QtCore
+    from PyQt4 import QtGui
+    _application = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv[:1]) # Kept alive until the benchmark has finished
+
+    from parallelcoordinates import PCManager
+    from parallelcoordinates_array import PCArrayDataInterface
+
+    times = dict((stage, list()) for stage in STAGES)
+    for run in range(repeat):
+        startTime = time.time()
+        dataInterface = PCArrayDataInterface(generateColumns(featureCount, attributeCount, nullShare), selectedIds = range(0, featureCount, 100))
+        times["generate"].append(time.time() - startTime)
+
+        pcManager = PCManager(None)
+        pcManager.setDataInterface(dataInterface)
+
+        # Reading the feature ids and attributes
+        startTime = time.time()
+        pcManager.updateData(lambda progress: None)
+        times["load"].append(time.time() - startTime)
+
+        # Reading and normalizing the columns of all attributes
+        attributeIds = sorted(pcManager.data.attributeDict)
+        startTime = time.time()
+        pcManager.setVisibleAttributes(attributeIds)
+        times["columns"].append(time.time() - startTime)
+
+        startTime = time.time()
+        for attributeId in attributeIds:
+            pcManager.data.normalizeColumn(pcManager.data.attributeDict[attributeId], pcManager.data.rawColumns[attributeId])
+        times["normalize"].append(time.time() - startTime)
+
+        startTime = time.time()
+        pcManager.renderImage()
+        times["render"].append(time.time() - startTime)
+
+        # Brushing the middle of the first axis selects about half of the features
+        y_center_px = (pcManager.y_pos_start_px + pcManager.y_pos_end_px) / 2.0
+        y_quarter_px = (pcManager.y_pos_end_px - pcManager.y_pos_start_px) / 4.0
+        startTime = time.time()
+        pcManager.rectangleSelection(QtCore.QPointF(pcManager.threshold_x_begin_px - 10, y_center_px - y_quarter_px),
+                                     QtCore.QPointF(pcManager.threshold_x_begin_px + 10, y_center_px + y_quarter_px))
+        pcManager.renderImage()
+        times["brush"].append(time.time() - startTime)
+
+        # Swapping the first and the last axis changes the neighbours of both, moveAxes schedules the redraw
+        startTime = time.time()
+        pcManager.data.moveAxes(0, len(attributeIds) - 1)
+        pcManager.renderImage()
+        times["reorder"].append(time.time() - startTime)
+
+        pcManager.removeData()
+        del pcManager, dataInterface
+
+    return dict((stage, min(stageTimes)) for stage, stageTimes in times.items()), peakMemory()
+
+def peakMemory():
+    """Returns the peak resident memory of this process in bytes or None if it is not known"""
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def runDataset(featureCount, attributeCount, arguments):
+    """Benchmarks one dataset in a new process and returns its result, or None if the process failed"""
+    command = [sys.executable, os.path.abspath(__file__), "--dataset", str(featureCount), str(attributeCount),
+               "--nulls", str(arguments.nulls), "--repeat", str(arguments.repeat)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        return None
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+def compareResults(results, baseline, tolerance):
+    """Prints the ratio of each time to the time of the baseline and returns the number of stages which are slower by more than tolerance"""
+    baselineResults = dict(((result["features"], result["attributes"]), result) for result in baseline["results"])
+    regressionCount = 0
+    for result in results["results"]:
+        baselineResult = baselineResults.get((result["features"], result["attributes"]))
+        if baselineResult is None:
+            continue
+        for stage in STAGES:
+            time_s = result["stages"].get(stage)
+            baselineTime_s = baselineResult["stages"].get(stage)
+            if time_s is None or not baselineTime_s:
+                continue
+            ratio = time_s / baselineTime_s
+            isRegression = ratio > 1.0 + tolerance and time_s - baselineTime_s > 0.01 # Differences below 10 ms are noise
+            regressionCount += isRegression
+            print("%8d features %3d attributes %-10s %9.3f s  baseline %9.3f s  %5.2fx%s" % (result["features"], result["attributes"], stage,
+                  time_s, baselineTime_s, ratio, "  SLOWER" if isRegression else ""))
+    return regressionCount
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the parallel coordinates on synthetic data without QGIS")
+    parser.add_argument("--features", type=int, nargs="+", default=[10000, 100000, 1000000], help="numbers of features of the datasets")
+    parser.add_argument("--attributes", type=int, nargs="+", default=[5, 20, 50], help="numbers of attributes of the datasets")
+    parser.add_argument("--nulls", type=float, default=0.05, help="share of NULL values")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs per dataset, the shortest time of each stage is taken")
+    parser.add_argument("--output", help="JSON file to which the results are written")
+    parser.add_argument("--baseline", help="JSON file of earlier results to which the results are compared")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="share by which a stage may be slower than in the baseline")
+    parser.add_argument("--dataset", type=int, nargs=2, help=argparse.SUPPRESS) # Used for the process of a single dataset
+    arguments = parser.parse_args()
+
+    if arguments.dataset is not None:
+        stageTimes, peakMemory_bytes = benchmarkDataset(arguments.dataset[0], arguments.dataset[1], arguments.nulls, arguments.repeat)
+        print(json.dumps({"features": arguments.dataset[0], "attributes": arguments.dataset[1], "stages": stageTimes, "peakMemory_bytes": peakMemory_bytes}))
+        return 0
+
+    results = {"python": platform.python_version(), "platform": platform.platform(), "nulls": arguments.nulls, "results": list()}
+    for featureCount in arguments.features:
+        for attributeCount in arguments.attributes:
+            result = runDataset(featureCount, attributeCount, arguments)
+            if result is None:
+                sys.stderr.write("Benchmark of %d features and %d attributes failed\n" % (featureCount, attributeCount))
+                continue
+            results["results"].append(result)
+            print("%8d features %3d attributes  %s  peak memory %s MB" % (featureCount, attributeCount,
+                  "  ".join("%s %.3f s" % (stage, result["stages"][stage]) for stage in STAGES),
+                  "%.0f" % (result["peakMemory_bytes"] / 1024.0**2) if result["peakMemory_bytes"] is not None else "unknown"))
+
+    if arguments.output is not None:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2, sort_keys=True)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        if compareResults(results, baseline, arguments.tolerance) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
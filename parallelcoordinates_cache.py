@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ ParallelCoordinates_Plugin
+                                 A QGIS plugin
+ Allows interactive visual analysis using parallel coordinates.
+                              -------------------
+        begin                : 2014-06-28
+        copyright            : (C) 2014 by Magnus Heitzler
+        email                : magnus.heitzler@gmx.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy
+
+from parallelcoordinates import PCAttribute
+
+class PCColumnCache(object):
+    """This class keeps the data read by PCData in a directory, so it does not have to be read from the data provider again.
+    Each key given by PCDataInterface.cacheKey gets a subdirectory holding the attributes, the feature ids, the bounding boxes
+    and each column as .npy file with the statistics found while reading it as .json file.
+    The least recently used subdirectories are removed if maximumSize_bytes is exceeded."""
+    def __init__(self, directory, maximumSize_bytes = 1024**3):
+        self.directory = directory
+        self.maximumSize_bytes = maximumSize_bytes
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def loadFeatures(self, key):
+        """Returns the attribute dictionary, the feature ids and the bounding boxes (None if there are none) stored for key or None if there are none"""
+        path = self.entryPath(key)
+        try:
+            with open(os.path.join(path, "attributes.json")) as attributesFile:
+                attributeValues = json.load(attributesFile)
+            featureIds = numpy.load(os.path.join(path, "featureIds.npy"))
+            bounds = None
+            if os.path.exists(os.path.join(path, "bounds.npy")):
+                bounds = numpy.load(os.path.join(path, "bounds.npy"))
+        except (IOError, OSError, ValueError): # Not cached or not complete
+            return None
+
+        attributeDict = dict()
+        for values in attributeValues:
+            attribute = PCAttribute(None, None, None)
+            attribute.__dict__.update(values)
+            attributeDict[attribute.id] = attribute
+
+        self.touch(path)
+        return attributeDict, featureIds, bounds
+
+    def storeFeatures(self, key, attributeDict, featureIds, bounds):
+        """Replaces whatever is stored for key by the attributes, feature ids and bounding boxes, the columns are added by storeColumn"""
+        path = self.entryPath(key)
+        if os.path.exists(path):
+            shutil.rmtree(path, True)
+
+        try:
+            os.makedirs(path)
+            if bounds is not None:
+                self.save(os.path.join(path, "bounds.npy"), bounds)
+            self.save(os.path.join(path, "featureIds.npy"), featureIds)
+
+            # The attributes are written last, as loadFeatures reads them first
+            temporaryPath = os.path.join(path, "attributes.json.tmp")
+            with open(temporaryPath, "w") as attributesFile:
+                json.dump([attribute.__dict__ for attribute in attributeDict.values()], attributesFile)
+            os.rename(temporaryPath, os.path.join(path, "attributes.json"))
+        except (IOError, OSError): # A cache which cannot be written is not used
+            shutil.rmtree(path, True)
+            return
+
+        self.evict(key)
+
+    def removeEntry(self, key):
+        """Removes everything stored for key"""
+        shutil.rmtree(self.entryPath(key), True)
+
+    def loadColumn(self, key, attributeId, memoryMapped = False):
+        """Returns the raw and the normalized column of the attribute stored for key or None if they are not stored.
+        If memoryMapped is True, the columns are read-only arrays whose values are read from the files on demand."""
+        path = self.entryPath(key)
+        mmapMode = "r" if memoryMapped else None
+        try:
+            rawColumn = numpy.load(os.path.join(path, "raw_%s.npy" % attributeId), mmap_mode = mmapMode)
+            normalizedColumn = numpy.load(os.path.join(path, "normalized_%s.npy" % attributeId), mmap_mode = mmapMode)
+        except (IOError, OSError, ValueError):
+            return None
+
+        self.touch(path)
+        return rawColumn, normalizedColumn
+
+    def storeColumn(self, key, attributeId, rawColumn, normalizedColumn):
+        path = self.entryPath(key)
+        if not os.path.exists(os.path.join(path, "attributes.json")): # The features of key have been evicted or replaced
+            return
+
+        try:
+            self.save(os.path.join(path, "raw_%s.npy" % attributeId), rawColumn)
+            self.save(os.path.join(path, "normalized_%s.npy" % attributeId), normalizedColumn)
+        except (IOError, OSError):
+            return
+
+        self.evict(key)
+
+    def loadStatistics(self, key, attributeId):
+        """Returns the statistics stored with the column of the attribute, see PCAttributeStatistics.values, or None if there are none"""
+        try:
+            with open(os.path.join(self.entryPath(key), "statistics_%s.json" % attributeId)) as statisticsFile:
+                return json.load(statisticsFile)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def storeStatistics(self, key, attributeId, statisticsValues):
+        path = self.entryPath(key)
+        if not os.path.exists(os.path.join(path, "attributes.json")):
+            return
+
+        statisticsPath = os.path.join(path, "statistics_%s.json" % attributeId)
+        try:
+            with open(statisticsPath + ".tmp", "w") as statisticsFile:
+                json.dump(statisticsValues, statisticsFile)
+            if os.path.exists(statisticsPath):
+                os.remove(statisticsPath)
+            os.rename(statisticsPath + ".tmp", statisticsPath)
+        except (IOError, OSError):
+            pass
+
+    def createColumn(self, key, attributeId, length, rawDtype):
+        """Returns a raw and a normalized column of the given length which are memory-mapped to temporary files of the entry of key.
+        Once they are filled, finishColumn turns them into the stored columns of the attribute. Returns None if the files cannot be created."""
+        path = self.entryPath(key)
+        try:
+            rawColumn = numpy.lib.format.open_memmap(os.path.join(path, "raw_%s.npy.tmp" % attributeId), mode = "w+", dtype = rawDtype, shape = (length,))
+            normalizedColumn = numpy.lib.format.open_memmap(os.path.join(path, "normalized_%s.npy.tmp" % attributeId), mode = "w+", dtype = float, shape = (length,))
+        except (IOError, OSError): # The entry has been evicted
+            return None
+        return rawColumn, normalizedColumn
+
+    def finishColumn(self, key, attributeId, rawColumn, normalizedColumn):
+        """Writes the columns created by createColumn to their files and returns them memory-mapped read-only.
+        Returns None if they cannot be written, e.g. because the entry has been evicted."""
+        path = self.entryPath(key)
+        try:
+            for column, name in ((rawColumn, "raw_%s.npy" % attributeId), (normalizedColumn, "normalized_%s.npy" % attributeId)):
+                column.flush()
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+                os.rename(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+        except (IOError, OSError):
+            return None
+        del rawColumn, normalizedColumn
+
+        self.evict(key)
+        return self.loadColumn(key, attributeId, True)
+
+    def save(self, path, array):
+        """Writes array to a temporary file first, so an interrupted write is never mistaken for a complete one"""
+        temporaryPath = path + ".tmp"
+        with open(temporaryPath, "wb") as arrayFile:
+            numpy.save(arrayFile, array)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temporaryPath, path)
+
+    def touch(self, path):
+        """Marks the entry at path as used, the modification time of its directory is used to find the least recently used entries"""
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def evict(self, keptKey):
+        """Removes the least recently used entries except the one of keptKey until the size of all entries is below maximumSize_bytes"""
+        keptPath = self.entryPath(keptKey)
+        self.touch(keptPath)
+
+        entries = list()
+        totalSize = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(path, fileName)) for fileName in os.listdir(path))
+                entries.append((os.path.getmtime(path), path, size))
+            except OSError: # Not a directory or removed in the meantime
+                continue
+            totalSize += size
+
+        for modificationTime, path, size in sorted(entries):
+            if totalSize <= self.maximumSize_bytes:
+                break
+            if path != keptPath:
+                shutil.rmtree(path, True)
+                totalSize -= size
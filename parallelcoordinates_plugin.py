@@ -27,6 +27,7 @@ from qgis.core import *
 import webbrowser
 
 from parallelcoordinates import *
+from parallelcoordinates_cache import PCColumnCache
 
 class ParallelCoordinates_Plugin:
     def __init__(self, iface):
@@ -63,6 +64,17 @@ class ParallelCoordinates_Plugin:
 
         # Progress dialog
         self.progressDialog = uic.loadUi(os.path.join (path, "ui_pk_progressDialog.ui"))
+        self.progressDialog.cancelButton.clicked.connect(self.loadingCanceled)
+        
+        # Data is loaded in the background, loaders which were canceled are kept until their threads have finished
+        self.loader = None
+        self.canceledLoaders = list()
+        
+        # Layer whose edits invalidate the spatial index of the loaded data
+        self.editedLayer = None
+        
+        # Data read from file based layers is kept between sessions
+        self.columnCache = PCColumnCache(os.path.join(QgsApplication.qgisSettingsDirPath(), "parallelcoordinates", "cache"))  # @UndefinedVariable
 
 
         self.dockWidget.hideInvisibleFeaturesCheckBox.clicked.connect(self.visibleFeaturesChanged)
@@ -89,6 +101,10 @@ class ParallelCoordinates_Plugin:
  
     def unload(self):
         self.timer.timeout.disconnect(self.visibleFeaturesChanged)
+        self.cancelLoading()
+        for loader in self.canceledLoaders:
+            loader.wait()
+        self.watchLayerEdits(None)
         self.pcManager.removeData()
         #del self.pcManager
         #del self.dataInterface
@@ -134,7 +150,6 @@ class ParallelCoordinates_Plugin:
         else:
             # update layers
             self.currentLayer = layerID
-            self.attributesToBeDisplayed = []
         
         # Disable pushbutton if "no layer" is chosen
         if (self.currentLayer == "no layer"):
@@ -142,19 +157,120 @@ class ParallelCoordinates_Plugin:
         else:
             self.dockWidget.selectAttributes.setEnabled(True)
         
-        if (self.dataInterface.setDataOfInterest(self.currentLayer)):
-            self.progressDialog.show()
-            self.pcManager.updateData(self.setProgress)
-            self.progressDialog.hide()
+        # A new data interface is used for each layer, so the interface of a loader that is still running is not changed
+        dataInterface = QGIS_VL_PCDataInterface(self.iface, self)
+        if (dataInterface.setDataOfInterest(self.currentLayer)):
+            data = PCData(dataInterface, self.pcManager)
+            data.columnCache = self.columnCache
+            self.dockWidget.selectAttributes.setEnabled(False) # Loading columns would cancel loading the layer
+            self.startLoading(data.fetchAllData, lambda result: self.layerLoaded(data, result))
         else:
+            self.cancelLoading()
+            self.watchLayerEdits(None)
+            self.attributesToBeDisplayed = []
+            self.dataInterface = dataInterface
+            self.pcManager.setDataInterface(dataInterface)
             self.pcManager.removeData()
 
 
     pass
 
+    def layerLoaded(self, data, result):
+        if result is not True: # Loading failed, the data loaded before is kept
+            data.clear()
+            self.chooseShownLayer()
+            return
+        
+        self.dockWidget.selectAttributes.setEnabled(True)
+        self.attributesToBeDisplayed = []
+        self.dataInterface = data.dataInterface
+        self.watchLayerEdits(data.dataInterface.selectedLayer)
+        self.pcManager.setData(data)
+    pass
+
+    def watchLayerEdits(self, layer):
+        """Invalidates the spatial index of the loaded data whenever a feature of layer is added, deleted or its geometry is changed"""
+        if self.editedLayer is not None:
+            try:
+                self.editedLayer.featureAdded.disconnect(self.layerEdited)
+                self.editedLayer.featureDeleted.disconnect(self.layerEdited)
+                self.editedLayer.geometryChanged.disconnect(self.layerEdited)
+            except (TypeError, RuntimeError): # The layer has already been deleted
+                pass
+        
+        self.editedLayer = layer
+        if layer is not None:
+            layer.featureAdded.connect(self.layerEdited)
+            layer.featureDeleted.connect(self.layerEdited)
+            layer.geometryChanged.connect(self.layerEdited)
+    pass
+
+    def layerEdited(self, *args):
+        # The bounding boxes are outdated, so the visible features are requested from the layer from now on
+        self.pcManager.data.spatialIndex = None
+    pass
+
+    def startLoading(self, job, loaded):
+        """Runs job in a PCDataLoader and calls loaded with its result unless it is canceled, a running job is canceled"""
+        self.cancelLoading()
+        
+        loader = PCDataLoader(job)
+        loader.progressChanged.connect(self.setProgress)
+        loader.finished.connect(lambda: self.loadingFinished(loader, loaded))
+        self.loader = loader
+        
+        self.setProgress(0)
+        self.progressDialog.show()
+        loader.start()
+    pass
+
+    def cancelLoading(self):
+        if self.loader is None:
+            return
+        
+        self.loader.cancel()
+        self.canceledLoaders.append(self.loader)
+        self.loader = None
+        self.progressDialog.hide()
+    pass
+
+    def loadingCanceled(self):
+        self.cancelLoading()
+        self.chooseShownLayer()
+    pass
+
+    def chooseShownLayer(self):
+        """Chooses the layer whose data is still shown in the combo box again, e.g. after loading another layer was canceled or failed"""
+        layerID = self.dataInterface.layerID
+        index = self.dockWidget.layerComboBox.findData(layerID)
+        if index == -1: # The layer has been removed in the meantime
+            layerID = "no layer"
+            index = 0
+            self.watchLayerEdits(None)
+            self.pcManager.removeData()
+        
+        self.dockWidget.layerComboBox.currentIndexChanged.disconnect(self.selectedLayerChanged)
+        self.dockWidget.layerComboBox.setCurrentIndex(index)
+        self.dockWidget.layerComboBox.currentIndexChanged.connect(self.selectedLayerChanged)
+        
+        self.currentLayer = layerID
+        self.dockWidget.selectAttributes.setEnabled(self.currentLayer != "no layer")
+    pass
+
+    def loadingFinished(self, loader, loaded):
+        if loader in self.canceledLoaders:
+            self.canceledLoaders.remove(loader)
+            return
+        
+        self.loader = None
+        self.progressDialog.hide()
+        if loader.error is not None:
+            QgsMessageLog.logMessage(loader.error, "Parallel Coordinates", QgsMessageLog.CRITICAL)  # @UndefinedVariable
+        loaded(loader.result)
+    pass
+
     def setProgress(self, progress):
         self.progressDialog.progressBar.setValue(progress)
-        QgsApplication.processEvents()
         pass
 
 
@@ -165,9 +281,11 @@ class ParallelCoordinates_Plugin:
         while (self.attributesDialog.attributesTable.rowCount() != 0):
             self.attributesDialog.attributesTable.removeRow(0)
         
-        # Get selected Layer
+        # Get the layer whose data is shown, the layer chosen in the combo box may still be loading
         layers = QgsMapLayerRegistry.instance().mapLayers()  # @UndefinedVariable
-        selectedLayer = layers[self.currentLayer]
+        if self.dataInterface.layerID not in layers:
+            return
+        selectedLayer = layers[self.dataInterface.layerID]
     
         # Refill the table according to self.attributeToPosition
         dataProvider = selectedLayer.dataProvider()
@@ -215,23 +333,57 @@ class ParallelCoordinates_Plugin:
                     self.attributesToBeDisplayed.append(index)
                     axis_position += 1
     
-        self.pcManager.setVisibleAttributes(self.attributesToBeDisplayed)
+        attributeIds = list(self.attributesToBeDisplayed)
+        data = self.pcManager.data
+        if len(data.missingAttributes(attributeIds)) > 0:
+            # Load the missing columns in the background and show the attributes afterwards; 
+            # the loader reads from a copy of the data interface, as the GUI thread keeps using the interface for the selection
+            dataInterface = data.dataInterface.copy()
+            if dataInterface is None:
+                return
+            job = lambda setProgress, isCanceled: data.readAttributeColumns(attributeIds, setProgress, isCanceled, dataInterface)
+            self.startLoading(job, lambda columns: self.attributesLoaded(data, columns, attributeIds))
+        else:
+            self.pcManager.setVisibleAttributes(attributeIds)
+    pass
+
+    def attributesLoaded(self, data, columns, attributeIds):
+        if data is not self.pcManager.data or columns is None:
+            return
+        
+        data.storeColumns(columns)
+        self.pcManager.setVisibleAttributes(attributeIds)
     pass
       
     def featureSelectionChanged(self, layer):
         if self.dataInterface is None:
             return
         
+        # The selection was made by brushing and has already been drawn
+        if self.dataInterface.selectionOrigin == "parallelcoordinates":
+            return
+        
         if layer.id() == self.dataInterface.layerID:
             #print layer.selectedFeaturesIds()
             self.pcManager.setSelectedFeatures(layer.selectedFeaturesIds())
     pass
       
     def mapExtentChanged(self):
-        self.timer.start(500);
+        # While the map is panned the lines are drawn from a sample, the full rendering follows when the map is idle
+        self.pcManager.beginInteraction()
+        
+        # With a spatial index the visible features are cheap to find, so they follow the map at once; the redraws are coalesced by the PCManager
+        if self.pcManager.data.spatialIndex is not None:
+            self.updateVisibleFeatures()
+        self.timer.start(100);
     pass
       
     def visibleFeaturesChanged(self):
+        self.updateVisibleFeatures()
+        self.pcManager.endInteraction()
+    pass
+    
+    def updateVisibleFeatures(self):
         
         if self.dockWidget.hideInvisibleFeaturesCheckBox.isChecked():
             selectionRectangle = self.iface.mapCanvas().extent() # Features only in extent
@@ -242,11 +394,19 @@ class ParallelCoordinates_Plugin:
             else:
                 selectionRectangle = QgsRectangle() # @UndefinedVariable; All Features of layer
                 self.allFeaturesVisible = True
+        
+        # The bounding boxes read while loading answer this without requesting the features from the layer
+        if selectionRectangle.isEmpty():
+            rectangle = None
+        else:
+            rectangle = (selectionRectangle.xMinimum(), selectionRectangle.yMinimum(), selectionRectangle.xMaximum(), selectionRectangle.yMaximum())
+        if self.pcManager.setVisibleRectangle(rectangle):
+            return
                 
         layers = QgsMapLayerRegistry.instance().mapLayers()  # @UndefinedVariable
         #print "visibleFeaturesChanged"
-        if self.currentLayer in layers:
-            selectedLayer = layers[self.currentLayer]
+        if self.dataInterface.layerID in layers: # The layer whose data is shown
+            selectedLayer = layers[self.dataInterface.layerID]
             #provider = selectedLayer.dataProvider() # Depreciated in 2.0
             #provider.select([], selectionRectangle, False) # @UndefinedVariable
 
@@ -259,6 +419,7 @@ class ParallelCoordinates_Plugin:
             idList = list()
             request=QgsFeatureRequest()
             request.setFilterRect(selectionRectangle)
+            request.setSubsetOfAttributes([]) # Only the ids are needed
             for feat in selectedLayer.getFeatures(request):
                 idList.append(feat.id())
 
@@ -283,6 +444,7 @@ class QGIS_VL_PCDataInterface(PCDataInterface):
         self.plugin = plugin
         self.iface = iface
         self.layerID = "no layer"
+        self.selectionOrigin = None # Set while the selection of the layer is changed by setSelectedFeatures, so its signals can be told apart
         
     def setDataOfInterest(self, layerID):
         self.layerID = layerID
@@ -294,10 +456,16 @@ class QGIS_VL_PCDataInterface(PCDataInterface):
         
         self.selectedLayer = layers[layerID]
         
-        self.selectedFeatureIds = self.selectedLayer.selectedFeaturesIds()
+        self.selectedFeatureIds = set(self.selectedLayer.selectedFeaturesIds()) # A set is needed for fast lookups of the ids
         
+        # The layer must only be used by the GUI thread, so everything a PCDataLoader needs is taken from it here: 
+        # the features are read from a feature source, which may be iterated in a different thread
         self.provider = self.selectedLayer.dataProvider()
-        self.featureIterator = self.selectedLayer.getFeatures()
+        self.featureSource = QgsVectorLayerFeatureSource(self.selectedLayer)  # @UndefinedVariable
+        self.featureIterator = None
+        self.batchIterator = None
+        self.numberFeatures = self.selectedLayer.featureCount()
+        self.key = self.createCacheKey()
 
         self.fields = self.provider.fields()
         self.fieldsCount = len(self.fields)
@@ -306,13 +474,56 @@ class QGIS_VL_PCDataInterface(PCDataInterface):
         return True
     pass
     
+    def copy(self):
+        """Returns a new interface of the same layer, whose features can be read in a PCDataLoader independently of this one, or None if the layer is gone"""
+        dataInterface = QGIS_VL_PCDataInterface(self.iface, self.plugin)
+        if not dataInterface.setDataOfInterest(self.layerID):
+            return None
+        return dataInterface
+    pass
+    
+    def featureCount(self):
+        return self.numberFeatures
+    pass
+    
+    def createCacheKey(self):
+        # Only files tell whether they changed, the key contains their modification times and sizes
+        if self.selectedLayer.isModified():
+            return None
+        
+        source = self.selectedLayer.source()
+        path = source.split("|")[0]
+        if not os.path.isfile(path):
+            return None
+        
+        paths = [path]
+        if os.path.splitext(path)[1].lower() == ".shp": # The attributes of shapefiles are stored in the .dbf file
+            paths.append(os.path.splitext(path)[0] + ".dbf")
+        
+        key = [self.provider.name(), source, self.selectedLayer.subsetString()]
+        for filePath in paths:
+            if os.path.isfile(filePath):
+                key.extend([filePath, repr(os.path.getmtime(filePath)), str(os.path.getsize(filePath))])
+        return "|".join(key)
+    pass
+    
+    def cacheKey(self):
+        return self.key
+    pass
+    
+    def getSelectedFeatureIds(self):
+        return self.selectedFeatureIds
+    pass
+    
     def getAttributesToBeDisplayed(self):
         return self.selectAttributes
     pass
       
     def finished(self):
-        # In this case, it just resets everything related to the layerID 
-        self.setDataOfInterest(self.layerID) 
+        # The next reading starts from the first feature again; the layer is not touched, as this may be called in a different thread
+        self.featureIterator = None
+        self.batchIterator = None
+        self.fieldIndex = -1
     pass
     
     
@@ -333,28 +544,31 @@ class QGIS_VL_PCDataInterface(PCDataInterface):
             
             attribute.isVisible = True
             attribute.unit = "unknown"
-            attribute.minimum = float(self.provider.minimumValue(self.fieldIndex))
-            attribute.maximum = float(self.provider.maximumValue(self.fieldIndex))
+            
+            # The provider would scan the features once per query, so PCData computes the statistics while reading the column
+            attribute.minimum = None
+            attribute.maximum = None
             
         else: # typeName == "String"
             attribute.scale = "categorical"
             
             attribute.isVisible = True
-            uniqueValuesList = self.provider.uniqueValues(self.fieldIndex)
-            uniqueValuesList = [str(value) for value in uniqueValuesList]
-            attribute.uniqueValues = uniqueValuesList
-            attribute.numberUniqueValues = len(uniqueValuesList)
-            #print uniqueValuesList
+            attribute.uniqueValues = None
+            attribute.numberUniqueValues = 0
     
         return True
     
     def nextFeature(self, feature):
         # Set feature values
+        if self.featureIterator is None:
+            self.featureIterator = self.featureSource.getFeatures(QgsFeatureRequest())
+        
         qgsFeature = QgsFeature()
         hasNextFeature = self.featureIterator.nextFeature(qgsFeature)
         #print "Has next feature: " + str(hasNextFeature)
 
         if (hasNextFeature == False):
+            self.featureIterator = None
             return False
 
         featureAttributes = qgsFeature.attributes()
@@ -381,9 +595,66 @@ class QGIS_VL_PCDataInterface(PCDataInterface):
         # Return if there are any features left to get # TODO: Revise
         return True
         
+    def supportsFeatureBatches(self):
+        return True
+    
+    def supportsBounds(self):
+        return True
+    
+    def nextFeatureBatch(self, batch, attributeIds, batchSize, withBounds = False):
+        if self.batchIterator is None:
+            # Neither geometries (unless their bounding boxes are asked for) nor attributes that are not asked for are read
+            request = QgsFeatureRequest()
+            if not withBounds:
+                request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setSubsetOfAttributes(attributeIds)
+            self.batchIterator = self.featureSource.getFeatures(request)
+        
+        featureIds = list()
+        featureIsSelected = list()
+        attributeValues = dict((attributeId, list()) for attributeId in attributeIds)
+        bounds = list() if withBounds else None
+        
+        qgsFeature = QgsFeature()
+        while len(featureIds) < batchSize and self.batchIterator.nextFeature(qgsFeature):
+            featureID = qgsFeature.id()
+            featureIds.append(featureID)
+            featureIsSelected.append(featureID in self.selectedFeatureIds)
+            
+            if withBounds:
+                geometry = qgsFeature.geometry()
+                if geometry is None:
+                    bounds.append(None)
+                else:
+                    box = geometry.boundingBox()
+                    bounds.append((box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()))
+            
+            featureAttributes = qgsFeature.attributes()
+            for attributeId, values in attributeValues.items():
+                value = featureAttributes[attributeId]
+                if value == NULL:
+                    value = None
+                values.append(value)
+        
+        if len(featureIds) == 0:
+            self.batchIterator = None
+            return False
+        
+        batch.ids = featureIds
+        batch.isSelected = featureIsSelected
+        batch.isVisible = [True] * len(featureIds)
+        batch.attributeValues = attributeValues
+        batch.bounds = bounds
+        return True
+        
     def setSelectedFeatures(self, idList):
-        self.selectedLayer.removeSelection()
-        self.selectedLayer.select(idList)
+        # A single call, so the layer emits selectionChanged only once
+        self.selectionOrigin = "parallelcoordinates"
+        try:
+            self.selectedLayer.setSelectedFeatures(idList)
+        finally:
+            self.selectionOrigin = None
+        self.selectedFeatureIds = set(idList)
 
     pass
   
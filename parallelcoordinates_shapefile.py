@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ ParallelCoordinates_Plugin
+                                 A QGIS plugin
+ Allows interactive visual analysis using parallel coordinates.
+                              -------------------
+        begin                : 2014-06-28
+        copyright            : (C) 2014 by Magnus Heitzler
+        email                : magnus.heitzler@gmx.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import re
+import codecs
+import struct
+import numpy
+
+from parallelcoordinates_array import PCArrayDataInterface
+
+class PCShapefileDataInterface(PCArrayDataInterface):
+    """This class provides the data of a shapefile without QGIS. The records of the .dbf file are parsed at once into the columns
+    of a PCArrayDataInterface, one array per field, the bounding boxes are read from the .shp file using the .shx file."""
+    def __init__(self, encoding = None):
+        PCArrayDataInterface.__init__(self)
+
+        self.encoding = encoding            # Encoding of the text fields, if None it is read from the .cpg file or UTF-8 is assumed
+        self.path = None
+        self.fields = list()                # List of (name, type, decimal count) tuples in the order of the .dbf file, the field indices are the attribute ids
+
+    def setDataOfInterest(self, path):
+        """Reads the shapefile at path (the .shp or .dbf file), returns False if it cannot be read"""
+        self.path = os.path.splitext(path)[0]
+        self.attributeIndex = -1
+        self.nextRow = 0
+        self.selectedFeatureIds = set()
+
+        try:
+            self.readDbf(self.path + ".dbf")
+            self.bounds = None
+            if os.path.exists(self.path + ".shp") and os.path.exists(self.path + ".shx"):
+                self.bounds = self.readBounds(self.path + ".shp", self.path + ".shx")
+        except (IOError, OSError, ValueError, LookupError, struct.error): # LookupError if the given encoding is not known
+            self.fields = list()
+            self.names = list()
+            self.columns = dict()
+            self.featureIds = numpy.zeros(0, dtype=numpy.int64)
+            self.bounds = None
+            return False
+
+        return True
+
+    def readDbf(self, path):
+        with open(path, "rb") as dbfFile:
+            data = dbfFile.read()
+
+        recordCount, headerLength, recordLength = struct.unpack("<IHH", data[4:12])
+
+        # The field descriptors of 32 bytes each end with 0x0D
+        self.fields = list()
+        self.names = list()
+        dtype = {"names": ["deletionFlag"], "formats": ["S1"], "offsets": [0], "itemsize": recordLength}
+        fieldOffset = 1
+        offset = 32
+        while offset < headerLength - 1 and data[offset:offset+1] != b"\r":
+            name, fieldType, length, decimalCount = struct.unpack("<11sc4xBB14x", data[offset:offset+32])
+            name = name.split(b"\0")[0].decode("ascii", "replace")
+            self.fields.append((name, fieldType.decode("ascii"), decimalCount))
+            self.names.append(name)
+            dtype["names"].append("f%d" % len(self.fields))
+            dtype["formats"].append("S%d" % length)
+            dtype["offsets"].append(fieldOffset)
+            fieldOffset += length
+            offset += 32
+        if fieldOffset > recordLength:
+            raise ValueError("The fields of %s are longer than its records" % path)
+
+        # All records are parsed at once as fixed-width byte strings, deleted records are skipped like QGIS does
+        recordCount = min(recordCount, (len(data) - headerLength) // recordLength)
+        records = numpy.frombuffer(data, dtype=numpy.dtype(dtype), count=recordCount, offset=headerLength)
+        rows = numpy.flatnonzero(records["deletionFlag"] != b"*")
+        self.featureIds = rows.astype(numpy.int64)
+
+        encoding = self.encoding
+        if encoding is None:
+            encoding = "utf-8"
+            if os.path.exists(os.path.splitext(path)[0] + ".cpg"):
+                with open(os.path.splitext(path)[0] + ".cpg") as cpgFile:
+                    encoding = self.findCodec(cpgFile.read().strip())
+
+        self.columns = dict()
+        for fieldIndex, (name, fieldType, decimalCount) in enumerate(self.fields):
+            values = numpy.char.strip(records["f%d" % (fieldIndex + 1)][rows])
+            if fieldType in ("N", "F"):
+                self.columns[fieldIndex] = self.parseNumbers(values)
+            else:
+                self.columns[fieldIndex] = self.parseTexts(values, encoding)
+
+    def findCodec(self, name):
+        """Returns the Python codec of an encoding name of a .cpg file, e.g. "UTF-8", "ANSI 1252", "1252" or "88591", or UTF-8 if it is not known"""
+        candidates = [name]
+        codePage = re.search(r"(\d+)$", name)
+        if codePage is not None: # Code pages given by their numbers, 8859x stands for ISO 8859-x
+            number = codePage.group(1)
+            candidates.append("iso8859-" + number[4:] if number.startswith("8859") and len(number) > 4 else "cp" + number)
+        for candidate in candidates:
+            try:
+                return codecs.lookup(candidate).name
+            except LookupError:
+                continue
+        return "utf-8"
+
+    def parseNumbers(self, values):
+        """Returns a float array of the numbers in the byte strings of values, NaN for empty or invalid ones"""
+        numbers = numpy.empty(len(values), dtype=float)
+        numbers.fill(numpy.nan)
+        isNotNull = values != b""
+        try:
+            numbers[isNotNull] = values[isNotNull].astype(float)
+        except ValueError: # Invalid numbers such as "*****" are rare, so only then each value is parsed on its own
+            for row in numpy.flatnonzero(isNotNull):
+                try:
+                    numbers[row] = float(values[row])
+                except ValueError:
+                    pass
+        return numbers
+
+    def parseTexts(self, values, encoding):
+        """Returns an object array of the decoded byte strings of values, None for empty ones"""
+        texts = numpy.empty(len(values), dtype=object)
+        distinctValues, inverse = numpy.unique(values, return_inverse=True)
+        decodedValues = [value.decode(encoding, "replace") if value != b"" else None for value in distinctValues.tolist()]
+        texts[:] = [decodedValues[index] for index in inverse.reshape(-1).tolist()]
+        return texts
+
+    def readBounds(self, shpPath, shxPath):
+        """Returns an array holding xMin, yMin, xMax, yMax of each feature, NaN for features without geometry"""
+        with open(shxPath, "rb") as shxFile:
+            shxData = shxFile.read()
+        with open(shpPath, "rb") as shpFile:
+            shpData = numpy.frombuffer(shpFile.read() + b"\0" * 36, dtype=numpy.uint8) # Points are shorter than boxes, so the last one is padded
+
+        # The index holds the offset of each record in 16-bit words, each record starts with an 8 byte header and the shape type
+        offsets = numpy.frombuffer(shxData, dtype=">i4", offset=100)[0::2].astype(numpy.int64) * 2 + 8
+        offsets = offsets[self.featureIds[self.featureIds < len(offsets)]]
+        shapeTypes = shpData[offsets[:, None] + numpy.arange(4)].copy().view("<i4").reshape(-1)
+        values = shpData[offsets[:, None] + 4 + numpy.arange(32)].copy().view("<f8")
+
+        bounds = numpy.empty((len(self.featureIds), 4), dtype=float)
+        bounds.fill(numpy.nan)
+        isPoint = (shapeTypes == 1) | (shapeTypes == 11) | (shapeTypes == 21)
+        hasBox = (shapeTypes != 0) & ~isPoint
+        bounds[:len(offsets)][isPoint] = values[isPoint][:, [0, 1, 0, 1]]
+        bounds[:len(offsets)][hasBox] = values[hasBox]
+        return bounds
+
+    def cacheKey(self):
+        key = ["shapefile", os.path.abspath(self.path)]
+        for extension in (".dbf", ".shp"):
+            if os.path.exists(self.path + extension):
+                key.extend([extension, repr(os.path.getmtime(self.path + extension)), str(os.path.getsize(self.path + extension))])
+        return "|".join(key)